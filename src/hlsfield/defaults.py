@@ -15,6 +15,8 @@
 Лицензия: MIT
 """
 
+import copy
+import functools
 import logging
 import os
 import uuid
@@ -69,6 +71,14 @@ def _get_setting(name: str, default):
 FFMPEG = _get_setting("HLSFIELD_FFMPEG", "ffmpeg")
 FFPROBE = _get_setting("HLSFIELD_FFPROBE", "ffprobe")
 FFMPEG_TIMEOUT = int(_get_setting("HLSFIELD_FFMPEG_TIMEOUT", 300))  # 5 минут
+# Потоки кодировщика для повариантных HLS энкодов, которые идут параллельно:
+# несколько FFmpeg по 4 потока загружают ядра лучше одного на все ядра.
+# Однопроходный и DASH энкод - один процесс, им потоки не ограничиваются.
+# FFMPEG_THREADS = 0 - не ограничивать потоки
+FFMPEG_THREADS = int(_get_setting("HLSFIELD_FFMPEG_THREADS", 4))
+# Максимум одновременных FFmpeg процессов на процесс Python; 0 - без ограничения
+# (параллелизм задают пулы вариантов и max_parallel)
+FFMPEG_CONCURRENCY = int(_get_setting("HLSFIELD_FFMPEG_CONCURRENCY", 0))
 
 
 # ==============================================================================
@@ -131,6 +141,10 @@ DEFAULT_PREVIEW_AT = float(_get_setting("HLSFIELD_DEFAULT_PREVIEW_AT", 3.0))
 PROCESS_ON_SAVE = bool(_get_setting("HLSFIELD_PROCESS_ON_SAVE", True))
 CREATE_PREVIEW = bool(_get_setting("HLSFIELD_CREATE_PREVIEW", True))
 EXTRACT_METADATA = bool(_get_setting("HLSFIELD_EXTRACT_METADATA", True))
+# Рядом с m3u8 кладется .m3u8.gz для раздачи с Content-Encoding: gzip
+GZIP_MANIFESTS = bool(_get_setting("HLSFIELD_GZIP_MANIFESTS", True))
+# Число одновременных загрузок в storage при сохранении HLS/DASH дерева
+STORAGE_IO_WORKERS = int(_get_setting("HLSFIELD_STORAGE_IO_WORKERS", 16))
 
 
 # ==============================================================================
@@ -158,6 +172,8 @@ ALLOWED_EXTENSIONS = _get_setting(
     "HLSFIELD_ALLOWED_EXTENSIONS",
     [".mp4", ".avi", ".mov", ".wmv", ".flv", ".webm", ".mkv", ".m4v", ".3gp", ".ogv"],
 )
+# Для проверок на каждой загрузке: O(1) поиск, регистр не важен
+ALLOWED_EXTENSIONS_SET = frozenset(ext.lower() for ext in ALLOWED_EXTENSIONS)
 
 MAX_VIDEO_HEIGHT = int(_get_setting("HLSFIELD_MAX_VIDEO_HEIGHT", 8192))
 MIN_VIDEO_HEIGHT = int(_get_setting("HLSFIELD_MIN_VIDEO_HEIGHT", 144))
@@ -212,13 +228,36 @@ SUPPORTED_CONTAINERS = ["mp4", "mov", "avi", "mkv", "webm", "flv"]
 # ==============================================================================
 
 
-def get_runtime_info() -> dict:
-    """Возвращает основную runtime информацию"""
+@functools.lru_cache(maxsize=None)
+def _binary_available(path: str) -> bool:
+    """Проверяет наличие бинарного файла (результат кешируется на процесс)"""
     import shutil
+
+    return shutil.which(path) is not None
+
+
+def get_runtime_info() -> dict:
+    """
+    Возвращает основную runtime информацию.
+
+    Результат кешируется: установка FFmpeg не меняется во время работы процесса.
+    Каждый вызов получает свою копию. Для повторной проверки (вместе с
+    validate_settings) вызовите clear_runtime_cache().
+    """
+    return copy.deepcopy(_runtime_info_cached())
+
+
+def clear_runtime_cache() -> None:
+    """Сбрасывает кеши проверок бинарников и runtime информации"""
+    _binary_available.cache_clear()
+    _runtime_info_cached.cache_clear()
+
+
+@functools.lru_cache(maxsize=1)
+def _runtime_info_cached() -> dict:
     import sys
 
-    ffmpeg_available = shutil.which(FFMPEG) is not None
-    ffprobe_available = shutil.which(FFPROBE) is not None
+    ffmpeg_available = _binary_available(FFMPEG)
     django_settings = _get_django_settings()
 
     return {
@@ -243,12 +282,10 @@ def validate_settings() -> list[str]:
     """Валидирует основные настройки"""
     issues = []
 
-    import shutil
-
-    if not shutil.which(FFMPEG):
+    if not _binary_available(FFMPEG):
         issues.append(f"FFmpeg not found at '{FFMPEG}'")
 
-    if not shutil.which(FFPROBE):
+    if not _binary_available(FFPROBE):
         issues.append(f"FFprobe not found at '{FFPROBE}'")
 
     if not DEFAULT_LADDER:
@@ -70,11 +70,13 @@ class HLSFieldError(Exception):
 # ==============================================================================
 
 
-class FFmpegNotFoundError(HLSFieldError):
+class FFmpegNotFoundError(HLSFieldError, FileNotFoundError):
     """
     FFmpeg или FFprobe не найдены в системе.
 
     Критическая ошибка конфигурации - без FFmpeg пакет не может работать.
+    Наследует FileNotFoundError: run() раньше поднимал его для ненайденных
+    команд, и код, который ловит FileNotFoundError, продолжает работать.
     """
 
     def __init__(self, binary_name: str = "ffmpeg"):
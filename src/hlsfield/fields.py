@@ -13,6 +13,7 @@
 
 from __future__ import annotations
 
+import bisect
 import datetime as dt
 import json
 import logging
@@ -252,13 +253,7 @@ class VideoFieldFile(models.fields.files.FieldFile):
         # Проверяем расширение
         if hasattr(content, "name") and content.name:
             ext = Path(content.name).suffix.lower()
-            allowed_exts = getattr(
-                defaults,
-                "ALLOWED_EXTENSIONS",
-                [".mp4", ".avi", ".mov", ".wmv", ".flv", ".webm", ".mkv"],
-            )
-
-            if ext not in allowed_exts:
+            if ext not in defaults.ALLOWED_EXTENSIONS_SET:
                 raise InvalidVideoError(f"Unsupported file extension: {ext}")
 
     def _process_video_metadata(self, field: VideoField, inst):
@@ -1110,6 +1105,19 @@ def validate_ladder(ladder: list[dict]) -> bool:
     return True
 
 
+# Базовые качества, отсортированы по высоте
+_BASE_LADDER = (
+    {"height": 240, "v_bitrate": 300, "a_bitrate": 64},
+    {"height": 360, "v_bitrate": 800, "a_bitrate": 96},
+    {"height": 480, "v_bitrate": 1200, "a_bitrate": 96},
+    {"height": 720, "v_bitrate": 2500, "a_bitrate": 128},
+    {"height": 1080, "v_bitrate": 4500, "a_bitrate": 160},
+    {"height": 1440, "v_bitrate": 8000, "a_bitrate": 192},
+    {"height": 2160, "v_bitrate": 15000, "a_bitrate": 256},  # 4K
+)
+_BASE_LADDER_HEIGHTS = tuple(rung["height"] for rung in _BASE_LADDER)
+
+
 def get_optimal_ladder_for_resolution(source_width: int, source_height: int) -> list[dict]:
     """
     Генерирует оптимальную лестницу качеств на основе разрешения источника.
@@ -1122,30 +1130,11 @@ def get_optimal_ladder_for_resolution(source_width: int, source_height: int) ->
         list[dict]: Оптимизированная лестница качеств
     """
 
-    # Базовые качества
-    base_ladder = [
-        {"height": 240, "v_bitrate": 300, "a_bitrate": 64},
-        {"height": 360, "v_bitrate": 800, "a_bitrate": 96},
-        {"height": 480, "v_bitrate": 1200, "a_bitrate": 96},
-        {"height": 720, "v_bitrate": 2500, "a_bitrate": 128},
-        {"height": 1080, "v_bitrate": 4500, "a_bitrate": 160},
-        {"height": 1440, "v_bitrate": 8000, "a_bitrate": 192},
-        {"height": 2160, "v_bitrate": 15000, "a_bitrate": 256},  # 4K
-    ]
-
-    # Фильтруем качества которые не превышают источник
-    filtered_ladder = []
-
-    for rung in base_ladder:
-        if rung["height"] <= source_height * 1.1:  # +10% запас
-            filtered_ladder.append(rung.copy())
-        else:
-            break
-
-    # Если исходное видео очень маленькое - добавляем хотя бы одно качество
-    if not filtered_ladder:
-        min_rung = min(base_ladder, key=lambda x: x["height"])
-        filtered_ladder.append(min_rung)
+    # Качества, не превышающие источник (+10% запас), - префикс таблицы
+    cutoff = bisect.bisect_right(_BASE_LADDER_HEIGHTS, source_height * 1.1)
+
+    # Если исходное видео очень маленькое - оставляем хотя бы минимальное качество
+    filtered_ladder = [rung.copy() for rung in _BASE_LADDER[: max(cutoff, 1)]]
 
     # Добавляем исходное разрешение как максимальное качество
     if filtered_ladder[-1]["height"] < source_height:
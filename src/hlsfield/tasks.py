@@ -39,6 +39,10 @@ except ImportError:
             func.delay = lambda *args, **kwargs: func(*args, **kwargs)
             return func
 
+        # @shared_task без скобок
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return decorator(args[0])
+
         return decorator
 
     CELERY_AVAILABLE = False
@@ -580,13 +584,13 @@ def optimize_existing_video(
         with utils.tempdir(prefix=f"optimize_{pk}_") as td:
             local_input = utils.pull_to_local(storage, name, td)
 
-            # Анализируем исходное видео
-            analysis = utils.analyze_video_complexity(local_input)
+            # Анализируем исходное видео: один запуск FFprobe на оба шага
+            info = utils.ffprobe_streams(local_input)
+            analysis = utils.analyze_video_complexity(local_input, streams=info)
 
             # Генерируем оптимальную лестницу
             from .fields import get_optimal_ladder_for_resolution
 
-            info = utils.ffprobe_streams(local_input)
             video_stream, _ = utils.pick_video_audio_streams(info)
 
             if video_stream:
@@ -761,15 +765,20 @@ def generate_video_analytics_report(days: int = 7):
         start_date = timezone.now() - timedelta(days=days)
         events = VideoEvent.objects.filter(timestamp__gte=start_date)
 
+        # Счетчики по типам событий одним GROUP BY вместо запроса на каждый тип
+        type_counts = dict(
+            events.order_by().values_list("event_type").annotate(models.Count("id"))
+        )
+
         report = {
             "period": f"Last {days} days",
-            "total_events": events.count(),
+            "total_events": sum(type_counts.values()),
             "unique_videos": events.values("video_id").distinct().count(),
             "unique_sessions": events.values("session_id").distinct().count(),
-            "play_events": events.filter(event_type="play").count(),
-            "completion_events": events.filter(event_type="ended").count(),
-            "error_events": events.filter(event_type="error").count(),
-            "buffer_events": events.filter(event_type="buffer_start").count(),
+            "play_events": type_counts.get("play", 0),
+            "completion_events": type_counts.get("ended", 0),
+            "error_events": type_counts.get("error", 0),
+            "buffer_events": type_counts.get("buffer_start", 0),
         }
 
         # Топ видео по просмотрам
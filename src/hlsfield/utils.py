@@ -8,21 +8,56 @@
 - Извлечения превью кадров
 - Работы с временными файлами и storage
 
+Про -ss: в командах, которым нужен один кадр (превью, проба), -ss стоит
+ДО -i - это быстрый seek демультиплексором к ближайшему ключевому кадру
+без декодирования с начала файла. Для транскодирования (HLS/DASH) seek не
+используется вовсе: точность границ сегментов важнее, и если понадобится
+обрезка, -ss ставится ПОСЛЕ -i. Не "исправляйте" порядок в превью обратно.
+
 Автор: akula993
 Лицензия: MIT
 """
 
+import asyncio
+import functools
+import gzip
 import json
 import logging
 import os
+import random
+import re
 import shutil
+import socket
+import struct
 import subprocess
 import tempfile
+import threading
 import time
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, fields
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union, Tuple
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Union, Tuple
 from enum import Enum
+from operator import attrgetter, itemgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from botocore.exceptions import ConnectionError as _BotoConnectionError, HTTPClientError
+    _BOTO_TRANSIENT_ERRORS = (_BotoConnectionError, HTTPClientError)
+except ImportError:
+    _BOTO_TRANSIENT_ERRORS = ()
+
+# orjson в разы быстрее разбирает вывод FFprobe; ошибки - подкласс ValueError,
+# как и у json.loads, так что обработка не меняется
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
 
 # Замените строку 26 в utils.py:
 try:
@@ -50,6 +85,31 @@ logger = logging.getLogger(__name__)
 # ==============================================================================
 
 
+def _remove_tree(root: Path) -> None:
+    """Удаляет дерево через os.scandir: тип записи берется из d_type без stat
+
+    Директории создаем мы сами (mkdtemp, права 0700), поэтому защитные
+    fstat/lstat shutil.rmtree от подмены симлинков здесь не нужны. При любой
+    ошибке доделывает shutil.rmtree.
+    """
+    try:
+        dirs = [os.fspath(root)]
+        i = 0
+        while i < len(dirs):
+            with os.scandir(dirs[i]) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    else:
+                        os.unlink(entry.path)
+            i += 1
+        # Вложенные директории идут после родителей - удаляем с конца
+        for path in reversed(dirs):
+            os.rmdir(path)
+    except OSError:
+        shutil.rmtree(root, ignore_errors=True)
+
+
 @contextmanager
 def tempdir(prefix: str = "hlsfield_"):
     """Контекстный менеджер для временных директорий"""
@@ -59,7 +119,7 @@ def tempdir(prefix: str = "hlsfield_"):
         yield temp_path
     finally:
         try:
-            shutil.rmtree(temp_path, ignore_errors=True)
+            _remove_tree(temp_path)
             logger.debug(f"Cleaned up temporary directory: {temp_path}")
         except Exception as e:
             logger.warning(f"Could not clean up temporary directory {temp_path}: {e}")
@@ -82,15 +142,75 @@ def ensure_binary_available(binary_name: str, path: str) -> str:
 # ==============================================================================
 
 
-def run(cmd: List[str], timeout_sec: Optional[int] = None) -> subprocess.CompletedProcess:
-    """Выполняет команду с обработкой ошибок и таймаутами"""
+# Сколько FFmpeg процессов одновременно может запустить этот процесс Python
+# (HLSFIELD_FFMPEG_CONCURRENCY); без настройки - без ограничения
+_ffmpeg_slots = (
+    threading.BoundedSemaphore(defaults.FFMPEG_CONCURRENCY)
+    if defaults.FFMPEG_CONCURRENCY > 0
+    else nullcontext()
+)
+
+
+def _with_threads(cmd: List[str]) -> List[str]:
+    """Ограничивает потоки кодировщика FFmpeg (если вызывающий не задал сам)
+
+    Только для повариантных HLS энкодов, которые идут параллельно.
+    """
+    if not defaults.FFMPEG_THREADS or "-threads" in cmd or len(cmd) < 2:
+        return cmd
+    # Опция вывода - перед последним аргументом (файлом вывода)
+    return [*cmd[:-1], "-threads", str(defaults.FFMPEG_THREADS), cmd[-1]]
+
+
+def _with_timelimit(cmd: List[str], timeout_sec: int) -> List[str]:
+    """Добавляет FFmpeg -timelimit в качестве страховки к таймауту Python
+
+    Нужен, когда таймаут на стороне Python уже не сработает (воркер убит,
+    FFmpeg осиротел): FFmpeg сам завершится по SIGXCPU. Лимит - в секундах
+    CPU, а многопоточный энкод тратит их быстрее реального времени, поэтому
+    бюджет умножается на число ядер.
+    """
+    if "-timelimit" in cmd:
+        return cmd
+    cpu_budget = int(timeout_sec) * (os.cpu_count() or 1)
+    return [cmd[0], "-timelimit", str(cpu_budget), *cmd[1:]]
+
+
+class RunResult(NamedTuple):
+    """Результат run(): код возврата и текстовый вывод процесса
+
+    Поля совпадают с атрибутами CompletedProcess, поэтому result.stdout
+    работает как раньше; кортеж можно и распаковать.
+    """
+
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+def _check_command(cmd: List[str]) -> None:
+    """Проверка команды перед запуском (общая для run() и _arun())"""
     if not cmd:
         raise ValueError("Command cannot be empty")
 
-    # Добавить проверку на безопасность команд
-    if any(dangerous in str(cmd) for dangerous in ['rm -rf', '>', '>>', '&', '|', ';']):
+    # Добавить проверку на безопасность команд.
+    # Граф -filter_complex законно содержит ';' между цепочками - его не проверяем
+    checked = [arg for i, arg in enumerate(cmd) if i == 0 or cmd[i - 1] != "-filter_complex"]
+    if any(dangerous in str(checked) for dangerous in ['rm -rf', '>', '>>', '&', '|', ';']):
         raise SecurityError("Potentially dangerous command detected")
 
+
+def run(
+    cmd: List[str], timeout_sec: Optional[int] = None, stdin: Optional[str] = None
+) -> RunResult:
+    """Выполняет команду с обработкой ошибок и таймаутами
+
+    stdin - текст, который передается процессу на стандартный вход.
+    """
+    _check_command(cmd)
+
+    is_ffmpeg = cmd[0] in (defaults.FFMPEG, 'ffmpeg')
+
     # Проверяем бинарные файлы только для FFmpeg команд
     if cmd[0] in [defaults.FFMPEG, defaults.FFPROBE, 'ffmpeg', 'ffprobe']:
         binary_path = ensure_binary_available(cmd[0], cmd[0])
@@ -106,12 +226,15 @@ def run(cmd: List[str], timeout_sec: Optional[int] = None) -> subprocess.Complet
         else:
             binary_path = shutil.which(cmd[0])
             if not binary_path:
-                raise FileNotFoundError(f"Command not found: {cmd[0]}")
+                raise FFmpegNotFoundError(cmd[0])
             cmd[0] = binary_path
 
     if timeout_sec is None:
         timeout_sec = defaults.FFMPEG_TIMEOUT
 
+    if is_ffmpeg:
+        cmd = _with_timelimit(cmd, timeout_sec)
+
     cmd_str = " ".join(cmd)
     logger.debug(f"Executing command: {cmd_str}")
 
@@ -122,10 +245,18 @@ def run(cmd: List[str], timeout_sec: Optional[int] = None) -> subprocess.Complet
     use_shell = cmd[0].lower() in builtin_commands
 
     try:
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=timeout_sec, check=False, shell=use_shell,
-            encoding='utf-8',  # Явно указываем кодировку UTF-8
-        )
+        # close_fds=False при абсолютном пути к бинарнику включает в CPython
+        # быстрый путь через posix_spawn (vfork) - без копирования таблиц страниц
+        # большого Django процесса. Утечки дескрипторов нет: Python создает их
+        # ненаследуемыми (PEP 446), а pipe'ы для stdout/stderr передаются явно.
+        with _ffmpeg_slots if is_ffmpeg else nullcontext():
+            result = subprocess.run(
+                cmd, capture_output=True, text=True, timeout=timeout_sec, check=False,
+                shell=use_shell,
+                encoding='utf-8',  # Явно указываем кодировку UTF-8
+                input=stdin,
+                close_fds=use_shell,
+            )
 
         elapsed = time.time() - start_time
         logger.debug(f"Command completed in {elapsed:.2f}s with code {result.returncode}")
@@ -139,7 +270,7 @@ def run(cmd: List[str], timeout_sec: Optional[int] = None) -> subprocess.Complet
         if result.returncode != 0:
             _handle_ffmpeg_error(cmd, result.returncode, result.stdout, result.stderr)
 
-        return result
+        return RunResult(result.returncode, result.stdout, result.stderr)
 
     except subprocess.TimeoutExpired as e:
         logger.error(f"Command timed out after {timeout_sec}s: {cmd_str}")
@@ -176,8 +307,8 @@ def _handle_ffmpeg_error(cmd: List[str], returncode: int, stdout: str, stderr: s
 # ==============================================================================
 
 
-def ffprobe_streams(input_path: Union[str, Path]) -> Dict[str, Any]:
-    """Анализирует видеофайл и возвращает информацию о потоках"""
+def _probe_raw(input_path: Union[str, Path]) -> Dict[str, Any]:
+    """Запускает FFprobe без кеша"""
     cmd = [
         defaults.FFPROBE,
         "-v",
@@ -191,7 +322,7 @@ def ffprobe_streams(input_path: Union[str, Path]) -> Dict[str, Any]:
 
     try:
         result = run(cmd, timeout_sec=30)
-        data = json.loads(result.stdout)
+        data = _json_loads(result.stdout)
 
         if "streams" not in data:
             raise InvalidVideoError("No streams found in video file")
@@ -207,6 +338,67 @@ def ffprobe_streams(input_path: Union[str, Path]) -> Dict[str, Any]:
             raise InvalidVideoError(f"Cannot analyze video file: {e}") from e
 
 
+@functools.lru_cache(maxsize=1024)
+def _probe_cached(path_str: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    # mtime/size входят в ключ: перезаписанный файл просто дает новый ключ
+    return _probe_raw(path_str)
+
+
+_probe_lock = threading.Lock()
+_probe_inflight: Dict[Tuple[str, int, int], threading.Lock] = {}
+
+
+def ffprobe_streams(input_path: Union[str, Path]) -> Dict[str, Any]:
+    """Анализирует видеофайл и возвращает информацию о потоках
+
+    Результат кешируется по (абсолютный путь, mtime, размер) - адаптивный
+    режим, валидация и пакетная обработка не гоняют FFprobe повторно по тому
+    же файлу. Кеш потокобезопасен (lru_cache + лок на ключ). Возвращаемый
+    dict общий для всех вызовов, изменять его нельзя.
+    """
+    try:
+        st = os.stat(input_path)
+    except OSError:
+        # Файла нет - пусть FFprobe сам сформирует понятную ошибку
+        return _probe_raw(input_path)
+
+    # Абсолютный путь: "video.mp4" и "./video.mp4" - один и тот же файл
+    key = (os.path.abspath(input_path), st.st_mtime_ns, st.st_size)
+
+    # Лок на ключ: параллельные запросы того же файла не запускают два FFprobe,
+    # а разные файлы (ffprobe_streams_batch) пробуются одновременно
+    with _probe_lock:
+        key_lock = _probe_inflight.setdefault(key, threading.Lock())
+    try:
+        with key_lock:
+            return _probe_cached(*key)
+    finally:
+        with _probe_lock:
+            _probe_inflight.pop(key, None)
+
+
+def clear_probe_cache() -> None:
+    """Сбрасывает кеш ffprobe_streams (например, между тестами)"""
+    _probe_cached.cache_clear()
+
+
+def ffprobe_streams_batch(
+    input_paths: Sequence[Union[str, Path]], max_workers: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """ffprobe_streams для набора файлов; FFprobe процессы идут параллельно
+
+    Результаты в порядке input_paths. Первая ошибка пробрасывается как есть.
+    """
+    paths = list(input_paths)
+    if len(paths) <= 1:
+        return [ffprobe_streams(path) for path in paths]
+
+    # FFprobe однопоточный и легкий по I/O - половины ядер достаточно
+    workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths)), thread_name_prefix="hlsfield-probe") as executor:
+        return list(executor.map(ffprobe_streams, paths))
+
+
 def pick_video_audio_streams(info: Dict[str, Any]) -> tuple[Optional[Dict], Optional[Dict]]:
     """Выбирает основные видео и аудио потоки"""
     video_stream = None
@@ -217,17 +409,123 @@ def pick_video_audio_streams(info: Dict[str, Any]) -> tuple[Optional[Dict], Opti
     for stream in streams:
         codec_type = stream.get("codec_type")
 
-        if codec_type == "video" and video_stream is None:
-            video_stream = stream
+        if codec_type == "video":
+            if video_stream is None:
+                video_stream = stream
+        elif codec_type == "audio":
+            if audio_stream is None:
+                audio_stream = stream
+        else:
+            continue
 
-        if codec_type == "audio" and audio_stream is None:
-            audio_stream = stream
+        # Оба найдены - субтитры/data потоки дальше можно не просматривать
+        if video_stream is not None and audio_stream is not None:
+            break
 
     return video_stream, audio_stream
 
 
+_MP4_FORMAT_NAME = "mov,mp4,m4a,3gp,3g2,mj2"  # как в ffprobe
+_MP4_MAX_MOOV = 64 * 1024 * 1024
+_MP4_UNKNOWN_DURATIONS = (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF)
+
+
+def _iter_mp4_boxes(buf: bytes):
+    """Итерирует боксы верхнего уровня буфера: (тип, начало данных, конец)"""
+    pos = 0
+    while pos + 8 <= len(buf):
+        size, box_type = struct.unpack_from(">I4s", buf, pos)
+        header_len = 8
+        if size == 1:
+            if pos + 16 > len(buf):
+                return
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header_len = 16
+        elif size == 0:
+            size = len(buf) - pos
+        if size < header_len or pos + size > len(buf):
+            return
+        yield box_type, pos + header_len, pos + size
+        pos += size
+
+
+def _quick_mp4_info(file_path: Union[str, Path]) -> Optional[Dict[str, Any]]:
+    """
+    Читает длительность MP4/MOV из moov/mvhd без запуска ffprobe.
+
+    Обходит боксы верхнего уровня через seek (mdat не читается) и разбирает
+    только moov. None - не MP4 или длительность не записана (например,
+    фрагментированный MP4): тогда нужен ffprobe.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if f.read(8)[4:8] != b"ftyp":
+                return None
+
+            pos = 0
+            while pos + 8 <= file_size:
+                f.seek(pos)
+                header = f.read(16)
+                size, box_type = struct.unpack_from(">I4s", header)
+                header_len = 8
+                if size == 1:
+                    if len(header) < 16:
+                        return None
+                    size = struct.unpack_from(">Q", header, 8)[0]
+                    header_len = 16
+                elif size == 0:
+                    size = file_size - pos
+                if size < header_len or pos + size > file_size:
+                    return None
+
+                if box_type == b"moov":
+                    if size > _MP4_MAX_MOOV:
+                        return None
+                    f.seek(pos + header_len)
+                    moov = f.read(size - header_len)
+                    break
+                pos += size
+            else:
+                return None
+    except OSError:
+        return None
+
+    duration = None
+    nb_streams = 0
+    for box_type, start, end in _iter_mp4_boxes(moov):
+        if box_type == b"trak":
+            nb_streams += 1
+        elif box_type == b"mvhd" and end - start >= 32:
+            if moov[start] == 1:
+                timescale, raw_duration = struct.unpack_from(">IQ", moov, start + 20)
+            else:
+                timescale, raw_duration = struct.unpack_from(">II", moov, start + 12)
+            if timescale and raw_duration not in _MP4_UNKNOWN_DURATIONS:
+                duration = raw_duration / timescale
+
+    if not duration:
+        return None
+
+    return {
+        "duration": duration,
+        "size": file_size,
+        # ffprobe считает битрейт формата так же: размер / длительность
+        "bitrate": int(file_size * 8 / duration),
+        "format_name": _MP4_FORMAT_NAME,
+        "nb_streams": nb_streams,
+    }
+
+
 def get_video_info_quick(file_path: Union[str, Path]) -> Dict[str, Any]:
-    """Быстро получает основную информацию о видео"""
+    """Быстро получает основную информацию о видео
+
+    Для MP4/MOV с длительностью в moov ffprobe не запускается вовсе.
+    """
+    info = _quick_mp4_info(file_path)
+    if info is not None:
+        return info
+
     try:
         cmd = [
             defaults.FFPROBE,
@@ -240,7 +538,7 @@ def get_video_info_quick(file_path: Union[str, Path]) -> Dict[str, Any]:
         ]
 
         result = run(cmd, timeout_sec=15)
-        data = json.loads(result.stdout)
+        data = _json_loads(result.stdout)
         format_info = data.get("format", {})
 
         return {
@@ -267,6 +565,21 @@ def get_video_info_quick(file_path: Union[str, Path]) -> Dict[str, Any]:
 # ==============================================================================
 
 
+def _preview_scale(width: Optional[int], height: Optional[int]) -> Optional[str]:
+    """Фильтр масштабирования превью (None - без масштабирования)"""
+    if width and height:
+        return f"scale={width}:{height}"
+    if width:
+        return f"scale={width}:-1"
+    if height:
+        return f"scale=-1:{height}"
+    return None
+
+
+# FFmpeg сообщает об этом, когда seek ушел за конец видео и кадр не записан
+_EMPTY_OUTPUT_RE = re.compile(r"Output file is empty|nothing was encoded")
+
+
 def extract_preview(
     input_path: Path,
     out_image: Path,
@@ -282,6 +595,7 @@ def extract_preview(
         try:
             seek_time = attempt_times[attempt] if attempt < len(attempt_times) else attempt
 
+            # -ss до -i: быстрый seek по ключевым кадрам (см. docstring модуля)
             cmd = [
                 defaults.FFMPEG,
                 "-y",
@@ -297,18 +611,18 @@ def extract_preview(
                 "image2",
             ]
 
-            if width or height:
-                if width and height:
-                    scale = f"scale={width}:{height}"
-                elif width:
-                    scale = f"scale={width}:-1"
-                else:
-                    scale = f"scale=-1:{height}"
+            scale = _preview_scale(width, height)
+            if scale:
                 cmd.extend(["-vf", scale])
 
             cmd.append(str(out_image))
 
-            run(cmd, timeout_sec=60)
+            result = run(cmd, timeout_sec=60)
+
+            # Диагноз по stderr самого FFmpeg - без лишних обращений к файлу
+            if _EMPTY_OUTPUT_RE.search(result.stderr):
+                logger.warning(f"No frame at {seek_time}s on attempt {attempt + 1}")
+                continue
 
             if out_image.exists() and out_image.stat().st_size > 100:
                 logger.debug(f"Preview extracted at {seek_time}s on attempt {attempt + 1}")
@@ -328,6 +642,51 @@ def extract_preview(
     raise TranscodingError(f"Failed to extract preview after {max_attempts} attempts")
 
 
+def extract_previews_multi(
+    input_path: Path,
+    out_dir: Path,
+    timestamps: Sequence[float],
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    name_template: str = "preview_{index:02d}.jpg",
+) -> List[Path]:
+    """
+    Извлекает несколько превью одним вызовом FFmpeg.
+
+    Для каждой метки времени - свой вход с быстрым seek (-ss до -i) и свой
+    выход: один процесс вместо N, и декодируются только кадры у ключевых
+    кадров, а не все видео до последней метки, как с фильтром select.
+
+    Returns:
+        List[Path]: Превью для меток, кадр которых удалось получить
+        (метки за концом видео пропускаются)
+    """
+    if not timestamps:
+        return []
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    outputs = [out_dir / name_template.format(index=i) for i in range(len(timestamps))]
+
+    cmd = [defaults.FFMPEG, "-y"]
+    for at_sec in timestamps:
+        cmd.extend(["-ss", str(at_sec), "-i", str(input_path)])
+
+    scale = _preview_scale(width, height)
+    for i, out_image in enumerate(outputs):
+        cmd.extend(["-map", f"{i}:v:0", "-frames:v", "1", "-q:v", "2"])
+        if scale:
+            cmd.extend(["-vf", scale])
+        cmd.extend(["-f", "image2", str(out_image)])
+
+    run(cmd, timeout_sec=60)
+
+    previews = [p for p in outputs if p.exists() and p.stat().st_size > 100]
+    if not previews:
+        raise TranscodingError(f"Failed to extract any of {len(timestamps)} previews")
+    return previews
+
+
 # ==============================================================================
 # ОПТИМИЗИРОВАННЫЙ ТРАНСКОДИНГ - НОВЫЙ КОД
 # ==============================================================================
@@ -338,9 +697,13 @@ class StreamFormat(Enum):
 
 class TranscodingConfig:
     """Конфигурация для транскодирования"""
-    def __init__(self, format_type: StreamFormat, segment_duration: int = 6):
+    def __init__(
+        self, format_type: StreamFormat, segment_duration: int = 6, remote_url: Optional[str] = None
+    ):
         self.format_type = format_type
         self.segment_duration = segment_duration
+        # HTTP(S) база, куда FFmpeg сам отправляет сегменты через PUT (только HLS)
+        self.remote_url = remote_url.rstrip("/") if remote_url else None
 
         # Настройки по умолчанию для каждого формата
         if format_type == StreamFormat.HLS:
@@ -354,6 +717,53 @@ class TranscodingConfig:
             self.container_format = "dash"
             self.segment_type = "mp4"
 
+@dataclass(frozen=True, slots=True)
+class HLSVariant:
+    """Готовый вариант качества HLS
+
+    Строки для master.m3u8 (resolution, codecs) считаются один раз при
+    создании, а не на каждую строку плейлиста.
+    """
+    height: int
+    bandwidth: int
+    dir: str
+    playlist: str = "index.m3u8"
+    width: int = 0
+    segments_count: int = 0
+    # None - неизвестно (старые dict без ключа), считаем что аудио есть
+    audio_bitrate: Optional[int] = None
+    resolution: str = ""
+    codecs: str = field(init=False)
+    bandwidth_str: str = field(init=False)
+
+    def __post_init__(self):
+        if not self.resolution:
+            object.__setattr__(self, "resolution", f"{self.width}x{self.height}")
+        has_audio = self.audio_bitrate is None or self.audio_bitrate > 0
+        object.__setattr__(self, "codecs", "avc1.42E01E,mp4a.40.2" if has_audio else "avc1.42E01E")
+        object.__setattr__(self, "bandwidth_str", str(self.bandwidth))
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HLSVariant":
+        """Создает вариант из dict старого формата, лишние ключи игнорируются"""
+        return cls(**{name: data[name] for name in _HLS_VARIANT_INIT_FIELDS if name in data})
+
+    def to_dict(self) -> Dict[str, Any]:
+        """dict в формате, который раньше возвращал _create_hls_variant"""
+        return {
+            "height": self.height,
+            "width": self.width,
+            "bandwidth": self.bandwidth,
+            "playlist": self.playlist,
+            "dir": self.dir,
+            "resolution": self.resolution,
+            "segments_count": self.segments_count,
+            "audio_bitrate": self.audio_bitrate,
+        }
+
+
+_HLS_VARIANT_INIT_FIELDS = tuple(f.name for f in fields(HLSVariant) if f.init)
+
 def _prepare_transcoding(input_path: Path, ladder: List[Dict]) -> Tuple[Dict, Dict, int, List[Dict]]:
     """Общая подготовка для любого типа транскодирования"""
     from .fields import validate_ladder
@@ -366,7 +776,6 @@ def _prepare_transcoding(input_path: Path, ladder: List[Dict]) -> Tuple[Dict, Di
     if not video_stream:
         raise InvalidVideoError("No video stream found in input file")
 
-    has_audio = audio_stream is not None
     source_height = int(video_stream.get("height", 0))
     filtered_ladder = _filter_ladder_by_source(ladder, source_height)
 
@@ -381,7 +790,6 @@ def _build_base_ffmpeg_command(
     """Строит базовую команду FFmpeg, общую для HLS и DASH"""
     height = int(rung["height"])
     v_bitrate = int(rung["v_bitrate"])
-    a_bitrate = int(rung["a_bitrate"]) if has_audio else 0
 
     cmd = [
         defaults.FFMPEG,
@@ -410,35 +818,68 @@ def _build_base_ffmpeg_command(
         "-sc_threshold", "0",
     ])
 
-    # Аудио
-    if has_audio and a_bitrate > 0:
-        cmd.extend([
-            "-map", "0:a:0",
-            "-c:a", defaults.AUDIO_CODEC,
-            "-b:a", f"{a_bitrate}k",
-            "-ac", str(defaults.AUDIO_CHANNELS),
-            "-ar", str(defaults.AUDIO_SAMPLE_RATE),
-        ])
-    else:
-        cmd.append("-an")
-
+    cmd.extend(_audio_args(rung, has_audio))
     return cmd
 
+def _audio_args(
+    rung: Dict,
+    has_audio: bool,
+    codec: Optional[str] = None,
+    channels: Optional[int] = None,
+    sample_rate: Optional[int] = None,
+    index: Optional[int] = None,
+) -> Tuple[str, ...]:
+    """Аудио-аргументы FFmpeg для ступени; has_audio считается один раз на транскод
+
+    index - номер аудиопотока выхода, когда в одном выходе их несколько (DASH):
+    опции адресуются этому потоку, а не всем сразу.
+    """
+    a_bitrate = int(rung["a_bitrate"]) if has_audio else 0
+    if not a_bitrate:
+        return ("-an",)
+    # "-c:a" + ":N" -> "-c:a:N"; у -ac/-ar тип потока указывается явно
+    spec = "" if index is None else f":{index}"
+    stream = "" if index is None else f":a:{index}"
+    return (
+        "-map", "0:a:0",
+        f"-c:a{spec}", codec or defaults.AUDIO_CODEC,
+        f"-b:a{spec}", f"{a_bitrate}k",
+        f"-ac{stream}", str(channels or defaults.AUDIO_CHANNELS),
+        f"-ar{stream}", str(sample_rate or defaults.AUDIO_SAMPLE_RATE),
+    )
+
 def _create_hls_variant(
     input_path: Path,
     out_dir: Path,
     rung: Dict,
     config: TranscodingConfig,
     has_audio: bool
-) -> Dict:
+) -> HLSVariant:
     """Создает один вариант качества HLS"""
-    height = int(rung["height"])
-    v_bitrate = int(rung["v_bitrate"])
-    a_bitrate = int(rung["a_bitrate"]) if has_audio else 0
+    cmd = _build_hls_variant_command(input_path, out_dir, rung, config, has_audio)
+    run(cmd, timeout_sec=600)
+    return _collect_hls_variant(out_dir, rung, has_audio, remote=config.remote_url is not None)
 
-    variant_dir = out_dir / f"v{height}"
+def _build_hls_variant_command(
+    input_path: Path,
+    out_dir: Path,
+    rung: Dict,
+    config: TranscodingConfig,
+    has_audio: bool
+) -> List[str]:
+    """Команда FFmpeg для одного варианта HLS (директория варианта создается здесь)"""
+    variant_dir = out_dir / f"v{int(rung['height'])}"
     variant_dir.mkdir(exist_ok=True)
-    playlist_file = variant_dir / "index.m3u8"
+
+    if config.remote_url:
+        # Сегменты и плейлист варианта уходят в storage прямо из мультиплексора,
+        # без промежуточной записи на диск и повторного чтения для загрузки
+        target = f"{config.remote_url}/{variant_dir.name}"
+        segment_name, playlist = f"{target}/seg_%04d.ts", f"{target}/index.m3u8"
+        http_args = ["-method", "PUT", "-http_persistent", "1", "-http_user_agent", "hlsfield/1.0"]
+    else:
+        segment_name, playlist = str(variant_dir / "seg_%04d.ts"), str(variant_dir / "index.m3u8")
+        http_args = []
 
     # Базовая команда
     cmd = _build_base_ffmpeg_command(input_path, rung, has_audio, config)
@@ -449,32 +890,175 @@ def _create_hls_variant(
         "-hls_time", str(config.segment_duration),
         "-hls_playlist_type", "vod",
         "-hls_segment_type", "mpegts",
-        "-hls_segment_filename", str(variant_dir / "seg_%04d.ts"),
+        "-hls_segment_filename", segment_name,
         "-hls_flags", "single_file+independent_segments",
-        str(playlist_file),
+        *http_args,
+        playlist,
     ])
+    # Варианты кодируются параллельно - каждому свой небольшой набор потоков
+    return _with_threads(cmd)
 
-    run(cmd, timeout_sec=600)
+def _collect_hls_variant(
+    out_dir: Path, rung: Dict, has_audio: bool, remote: bool = False
+) -> HLSVariant:
+    """Проверяет результат FFmpeg для варианта и собирает HLSVariant
 
-    # Валидация результата
-    if not playlist_file.exists():
-        raise TranscodingError(f"HLS playlist not created: {playlist_file}")
+    При remote=True файлы лежат в удаленном storage - локальной проверки нет,
+    ошибку загрузки уже сообщил бы FFmpeg ненулевым кодом.
+    """
+    height = int(rung["height"])
+    v_bitrate = int(rung["v_bitrate"])
+    a_bitrate = int(rung["a_bitrate"]) if has_audio else 0
+
+    variant_dir = out_dir / f"v{height}"
+    playlist_file = variant_dir / "index.m3u8"
+
+    segments_count = 0
+    if not remote:
+        # Валидация результата
+        if not playlist_file.exists():
+            raise TranscodingError(f"HLS playlist not created: {playlist_file}")
 
-    segment_files = list(variant_dir.glob("seg_*.ts"))
-    if not segment_files:
-        raise TranscodingError(f"No HLS segments created in {variant_dir}")
+        segments_count = _count_segments(variant_dir)
+        if not segments_count:
+            raise TranscodingError(f"No HLS segments created in {variant_dir}")
 
     approx_width = int((height * 16 / 9) // 2 * 2)
 
-    return {
-        "height": height,
-        "width": approx_width,
-        "bandwidth": (v_bitrate + a_bitrate) * 1000,
-        "playlist": playlist_file.name,
-        "dir": variant_dir.name,
-        "resolution": f"{approx_width}x{height}",
-        "segments_count": len(segment_files),
-    }
+    return HLSVariant(
+        height=height,
+        width=approx_width,
+        bandwidth=(v_bitrate + a_bitrate) * 1000,
+        playlist=playlist_file.name,
+        dir=variant_dir.name,
+        segments_count=segments_count,
+        audio_bitrate=a_bitrate,
+    )
+
+def _count_segments(variant_dir: Union[str, Path], suffix: str = ".ts") -> int:
+    """Считает сегменты одним проходом readdir, без stat на каждый файл"""
+    with os.scandir(variant_dir) as entries:
+        return sum(1 for e in entries if e.name.endswith(suffix))
+
+def _count_segments_per_variant(out_dir: Path, suffix: str = ".ts") -> Dict[str, int]:
+    """Число сегментов в каждой поддиректории варианта: {"v360": 42, ...}"""
+    with os.scandir(out_dir) as entries:
+        return {
+            e.name: _count_segments(e.path, suffix)
+            for e in entries
+            if e.is_dir(follow_symlinks=False)
+        }
+
+def _split_scale_graph(scales: Sequence[str]) -> str:
+    """Граф "[0:v]split=N[v0]..;[v0]<scale>[o0];..." - один список кусков и один join"""
+    n = len(scales)
+    chunks = [f"[0:v]split={n}"]
+    chunks.extend(f"[v{i}]" for i in range(n))
+    for i, scale in enumerate(scales):
+        chunks.append(f";[v{i}]{scale}[o{i}]")
+    return "".join(chunks)
+
+def _build_hls_filter_complex(filtered_ladder: List[Dict]) -> str:
+    """Строит -filter_complex: один decode, split на N веток и scale на каждую"""
+    return _split_scale_graph([
+        f"scale=w=-2:h={int(rung['height'])}:force_original_aspect_ratio=decrease,"
+        "pad=ceil(iw/2)*2:ceil(ih/2)*2"
+        for rung in filtered_ladder
+    ])
+
+def _create_hls_variants_fused(
+    input_path: Path,
+    out_dir: Path,
+    filtered_ladder: List[Dict],
+    config: TranscodingConfig,
+    has_audio: bool
+) -> Path:
+    """Создает все варианты HLS и master.m3u8 одним запуском FFmpeg
+
+    Вход декодируется один раз вместо N, а fork+exec и инициализация FFmpeg
+    оплачиваются однократно. Но падение любого варианта роняет весь
+    запуск - частичного результата здесь нет.
+    """
+    gop = str(config.segment_duration * 30)
+
+    cmd = [
+        defaults.FFMPEG, "-y",
+        "-i", str(input_path),
+        "-filter_complex", _build_hls_filter_complex(filtered_ladder),
+    ]
+
+    stream_map = []
+    for i, rung in enumerate(filtered_ladder):
+        height = int(rung["height"])
+        v_bitrate = int(rung["v_bitrate"])
+        (out_dir / f"v{height}").mkdir(exist_ok=True)
+
+        cmd.extend([
+            "-map", f"[o{i}]",
+            f"-b:v:{i}", f"{v_bitrate}k",
+            f"-maxrate:v:{i}", f"{int(v_bitrate * 1.07)}k",
+            f"-bufsize:v:{i}", f"{v_bitrate * 2}k",
+        ])
+        if has_audio:
+            cmd.extend(["-map", "0:a:0", f"-b:a:{i}", f"{int(rung['a_bitrate'])}k"])
+            stream_map.append(f"v:{i},a:{i},name:{height}")
+        else:
+            stream_map.append(f"v:{i},name:{height}")
+
+    cmd.extend([
+        "-c:v", "libx264",
+        "-profile:v", defaults.H264_PROFILE,
+        "-preset", defaults.FFMPEG_PRESET,
+        "-pix_fmt", defaults.PIXEL_FORMAT,
+        "-g", gop,
+        "-keyint_min", gop,
+        "-sc_threshold", "0",
+    ])
+    if has_audio:
+        cmd.extend([
+            "-c:a", defaults.AUDIO_CODEC,
+            "-ac", str(defaults.AUDIO_CHANNELS),
+            "-ar", str(defaults.AUDIO_SAMPLE_RATE),
+        ])
+    else:
+        cmd.append("-an")
+
+    # %v подставляется из name: в var_stream_map - раскладка v{height}/ как у покадрового пути
+    cmd.extend([
+        "-f", "hls",
+        "-hls_time", str(config.segment_duration),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_type", "mpegts",
+        "-hls_flags", "independent_segments",
+        "-hls_segment_filename", str(out_dir / "v%v" / "seg_%04d.ts"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", " ".join(stream_map),
+        str(out_dir / "v%v" / "index.m3u8"),
+    ])
+
+    run(cmd, timeout_sec=600 * len(filtered_ladder))
+
+    master_file = out_dir / "master.m3u8"
+    if not master_file.exists():
+        raise TranscodingError(f"HLS master playlist not created: {master_file}")
+
+    counts = _count_segments_per_variant(out_dir)
+    for rung in filtered_ladder:
+        variant_dir = out_dir / f"v{int(rung['height'])}"
+        if not (variant_dir / "index.m3u8").exists():
+            raise TranscodingError(f"HLS playlist not created: {variant_dir / 'index.m3u8'}")
+        if not counts.get(variant_dir.name):
+            raise TranscodingError(f"No HLS segments created in {variant_dir}")
+
+    return master_file
+
+@functools.lru_cache(maxsize=32)
+def _build_dash_filter_complex(heights: Tuple[int, ...]) -> str:
+    """-filter_complex для DASH: один decode, split и scale на каждое качество
+
+    Лестница обычно одна из нескольких профилей, поэтому строка кешируется.
+    """
+    return _split_scale_graph([f"scale=-2:{h}" for h in heights])
 
 def _create_dash_variants(
     input_path: Path,
@@ -486,34 +1070,34 @@ def _create_dash_variants(
     """Создает все варианты DASH одной командой"""
     manifest_file = out_dir / "manifest.mpd"
 
-    cmd = [defaults.FFMPEG, "-y", "-i", str(input_path)]
+    heights = tuple(int(rung["height"]) for rung in filtered_ladder)
+    cmd = [
+        defaults.FFMPEG, "-y",
+        "-i", str(input_path),
+        "-filter_complex", _build_dash_filter_complex(heights),
+    ]
 
-    # Для каждого качества создаем отдельный поток
+    # Для каждого качества создаем отдельный поток; битрейты видео и аудио
+    # адресуются по индексу потока, иначе последнее значение применилось бы ко всем
+    audio_outputs = 0
     for i, rung in enumerate(filtered_ladder):
-        height = int(rung["height"])
         v_bitrate = int(rung["v_bitrate"])
 
         cmd.extend([
-            "-map", "0:v:0",
-            "-c:v", "libx264",
+            "-map", f"[o{i}]",
+            f"-c:v:{i}", "libx264",
             "-preset", "veryfast",
             "-profile:v", "main",
-            "-b:v", f"{v_bitrate}k",
-            "-maxrate", f"{int(v_bitrate * 1.07)}k",
-            "-bufsize", f"{v_bitrate * 2}k",
-            "-vf", f"scale=-2:{height}",
+            f"-b:v:{i}", f"{v_bitrate}k",
+            f"-maxrate:v:{i}", f"{int(v_bitrate * 1.07)}k",
+            f"-bufsize:v:{i}", f"{v_bitrate * 2}k",
             "-pix_fmt", "yuv420p",
         ])
-
-        if has_audio:
-            a_bitrate = int(rung["a_bitrate"])
-            cmd.extend([
-                "-map", "0:a:0",
-                "-c:a", "aac",
-                "-b:a", f"{a_bitrate}k",
-                "-ac", "2",
-                "-ar", "48000",
-            ])
+        # Ступень без аудио (a_bitrate 0) просто не получает аудиопоток:
+        # "-an" выключил бы звук всему выходу, всем representation сразу
+        if has_audio and int(rung["a_bitrate"]):
+            cmd.extend(_audio_args(rung, has_audio, "aac", 2, 48000, index=audio_outputs))
+            audio_outputs += 1
 
     # DASH параметры
     cmd.extend([
@@ -523,7 +1107,7 @@ def _create_dash_variants(
         "-use_timeline", "1",
         "-init_seg_name", str(out_dir / "init_$RepresentationID$.m4s"),
         "-media_seg_name", str(out_dir / "chunk_$RepresentationID$_$Number%05d$.m4s"),
-        "-adaptation_sets", "id=0,streams=v id=1,streams=a" if has_audio else "id=0,streams=v",
+        "-adaptation_sets", "id=0,streams=v id=1,streams=a" if audio_outputs else "id=0,streams=v",
         str(manifest_file)
     ])
 
@@ -542,34 +1126,84 @@ def _create_dash_variants(
     logger.info(f"DASH created with {len(segment_files)} segments and {len(init_files)} init files")
     return manifest_file
 
-def _create_master_playlist(out_dir: Path, variants: List[Dict]) -> Path:
-    """Создает master.m3u8 плейлист для HLS"""
+_MASTER_HEADER = "#EXTM3U\n#EXT-X-VERSION:3\n"
+# Строки кодеков и разрешения уже посчитаны в HLSVariant - шаблону нужен один вариант на поток
+_STREAM_INF_TEMPLATE = (
+    '#EXT-X-STREAM-INF:BANDWIDTH={v.bandwidth_str},RESOLUTION={v.resolution},CODECS="{v.codecs}"\n'
+    "{v.dir}/{v.playlist}\n"
+)
+
+def _create_master_playlist(
+    out_dir: Path,
+    variants: Sequence[Union[HLSVariant, Dict]],
+    gzip_manifests: Optional[bool] = None,
+) -> Path:
+    """Создает master.m3u8 плейлист для HLS
+
+    Пишется во временный файл и подменяется через os.replace - плеер или
+    CDN никогда не увидят наполовину записанный master.
+
+    gzip_manifests (по умолчанию HLSFIELD_GZIP_MANIFESTS) дополнительно
+    кладет master.m3u8.gz и index.m3u8.gz вариантов - веб-сервер отдает их
+    как есть с Content-Encoding: gzip, без сжатия на каждый запрос.
+    """
+    if gzip_manifests is None:
+        gzip_manifests = defaults.GZIP_MANIFESTS
+
     master_file = out_dir / "master.m3u8"
 
-    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
-    sorted_variants = sorted(variants, key=lambda x: x["height"])
+    variants = [v if isinstance(v, HLSVariant) else HLSVariant.from_dict(v) for v in variants]
+    # Плееры берут первый подходящий поток - порядок по BANDWIDTH, сортировка один раз
+    sorted_variants = sorted(variants, key=attrgetter("bandwidth"))
 
-    for variant in sorted_variants:
-        stream_inf = f"#EXT-X-STREAM-INF:BANDWIDTH={variant['bandwidth']}"
-        stream_inf += f",RESOLUTION={variant['resolution']}"
-        stream_inf += f',CODECS="avc1.42E01E,mp4a.40.2"'
+    chunks = [_MASTER_HEADER]
+    chunks.extend(_STREAM_INF_TEMPLATE.format(v=variant) for variant in sorted_variants)
+    content = "".join(chunks).encode("utf-8")
+    _write_atomic(master_file, content)
 
-        lines.append(stream_inf)
-        lines.append(f"{variant['dir']}/{variant['playlist']}")
+    if gzip_manifests:
+        _write_gzip_copy(master_file, content)
+        for variant in sorted_variants:
+            playlist = out_dir / variant.dir / variant.playlist
+            # При загрузке через remote_url локальных плейлистов вариантов нет
+            if playlist.exists():
+                _write_gzip_copy(playlist, playlist.read_bytes())
 
-    master_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
     return master_file
 
+def _write_atomic(path: Path, data: bytes) -> None:
+    """Пишет файл через временный + os.replace"""
+    tmp_file = path.with_name(path.name + ".tmp")
+    tmp_file.write_bytes(data)
+    os.replace(tmp_file, path)
+
+def _write_gzip_copy(path: Path, data: bytes) -> None:
+    """Кладет рядом path.gz; mtime=0 - одинаковый контент дает одинаковые байты"""
+    _write_atomic(path.with_name(path.name + ".gz"), gzip.compress(data, compresslevel=6, mtime=0))
+
 def transcode_variants(
     input_path: Path,
     out_dir: Path,
     ladder: List[Dict],
     format_type: StreamFormat,
-    segment_duration: int = 6
+    segment_duration: int = 6,
+    max_parallel: Optional[int] = None,
+    single_pass: bool = False,
+    remote_url: Optional[str] = None,
 ) -> Path:
-    """Универсальная функция транскодирования для HLS или DASH"""
+    """Универсальная функция транскодирования для HLS или DASH
+
+    max_parallel ограничивает число одновременных FFmpeg процессов (только HLS).
+    single_pass кодирует всю лестницу HLS одним FFmpeg через -filter_complex.
+    remote_url - HTTP база, куда FFmpeg загружает сегменты HLS через PUT.
+    master.m3u8 все равно пишется локально в out_dir: его нужно загрузить
+    в storage отдельно (например, save_tree_to_storage).
+    """
     try:
-        config = TranscodingConfig(format_type, segment_duration)
+        if remote_url and (single_pass or format_type != StreamFormat.HLS):
+            raise ConfigurationError("remote_url is supported only for per-rung HLS transcoding")
+
+        config = TranscodingConfig(format_type, segment_duration, remote_url=remote_url)
         out_dir.mkdir(parents=True, exist_ok=True)
 
         logger.info(f"Analyzing input video: {input_path}")
@@ -579,7 +1213,9 @@ def transcode_variants(
         logger.info(f"Transcoding {len(filtered_ladder)} {format_type.value.upper()} variants")
 
         if format_type == StreamFormat.HLS:
-            return _transcode_hls(input_path, out_dir, filtered_ladder, config, has_audio)
+            if single_pass:
+                return _create_hls_variants_fused(input_path, out_dir, filtered_ladder, config, has_audio)
+            return _transcode_hls(input_path, out_dir, filtered_ladder, config, has_audio, max_parallel)
         elif format_type == StreamFormat.DASH:
             return _transcode_dash(input_path, out_dir, filtered_ladder, config, has_audio)
 
@@ -594,19 +1230,38 @@ def _transcode_hls(
     out_dir: Path,
     filtered_ladder: List[Dict],
     config: TranscodingConfig,
-    has_audio: bool
+    has_audio: bool,
+    max_parallel: Optional[int] = None,
 ) -> Path:
-    """Внутренняя функция для HLS транскодирования"""
+    """Внутренняя функция для HLS транскодирования
+
+    Варианты независимы, поэтому кодируются параллельно. Пул потоков, а не
+    процессов: Python здесь только ждет FFmpeg (GIL отпущен на subprocess),
+    а CPU нагружает сам FFmpeg.
+
+    Старшие качества ставятся в очередь первыми: при max_parallel меньше
+    числа вариантов самый долгий энкод не остается хвостом в конце.
+    """
     variant_infos = []
 
-    for rung in filtered_ladder:
-        try:
-            variant_info = _create_hls_variant(input_path, out_dir, rung, config, has_audio)
-            variant_infos.append(variant_info)
-            logger.info(f"Created HLS variant: {variant_info['height']}p")
-        except Exception as e:
-            logger.error(f"Failed to create {rung['height']}p HLS variant: {e}")
-            continue
+    workers = min(len(filtered_ladder), os.cpu_count() or 1)
+    if max_parallel:
+        workers = min(workers, max_parallel)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="hlsfield-hls") as executor:
+        futures = {
+            executor.submit(_create_hls_variant, input_path, out_dir, rung, config, has_audio): rung
+            for rung in sorted(filtered_ladder, key=itemgetter("height"), reverse=True)
+        }
+        for future in as_completed(futures):
+            rung = futures[future]
+            try:
+                variant_info = future.result()
+                variant_infos.append(variant_info)
+                logger.info(f"Created HLS variant: {variant_info.height}p")
+            except Exception as e:
+                logger.error(f"Failed to create {rung['height']}p HLS variant: {e}")
+                continue
 
     if not variant_infos:
         raise TranscodingError("No HLS variants were successfully created")
@@ -631,10 +1286,19 @@ def _transcode_dash(
 # ==============================================================================
 
 def transcode_hls_variants(
-    input_path: Path, out_dir: Path, ladder: List[Dict], segment_duration: int = 6
+    input_path: Path,
+    out_dir: Path,
+    ladder: List[Dict],
+    segment_duration: int = 6,
+    max_parallel: Optional[int] = None,
+    single_pass: bool = False,
+    remote_url: Optional[str] = None,
 ) -> Path:
     """Создает HLS адаптивный стрим"""
-    return transcode_variants(input_path, out_dir, ladder, StreamFormat.HLS, segment_duration)
+    return transcode_variants(
+        input_path, out_dir, ladder, StreamFormat.HLS, segment_duration,
+        max_parallel=max_parallel, single_pass=single_pass, remote_url=remote_url,
+    )
 
 def transcode_dash_variants(
     input_path: Path, out_dir: Path, ladder: List[Dict], segment_duration: int = 4
@@ -654,14 +1318,22 @@ def transcode_adaptive_variants(
 
         logger.info(f"Starting adaptive transcoding (HLS + DASH) for {input_path.name}")
 
-        # Создаем HLS
-        logger.info("Creating HLS stream...")
-        hls_master = transcode_variants(input_path, hls_dir, ladder, StreamFormat.HLS, segment_duration)
-
-        # Создаем DASH
-        logger.info("Creating DASH stream...")
+        # HLS и DASH независимы (разные директории) - кодируем одновременно,
+        # Python лишь ждет FFmpeg, так что потоков достаточно
+        logger.info("Creating HLS and DASH streams...")
         dash_segment_duration = max(2, segment_duration - 2)
-        dash_manifest = transcode_variants(input_path, dash_dir, ladder, StreamFormat.DASH, dash_segment_duration)
+
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="hlsfield-adaptive") as executor:
+            hls_future = executor.submit(
+                transcode_variants, input_path, hls_dir, ladder, StreamFormat.HLS, segment_duration
+            )
+            dash_future = executor.submit(
+                transcode_variants, input_path, dash_dir, ladder, StreamFormat.DASH, dash_segment_duration
+            )
+            # Оба энкода стартуют сразу; при ошибке одного выход из with
+            # дожидается второго, и только потом ошибка уходит выше
+            hls_master = hls_future.result()
+            dash_manifest = dash_future.result()
 
         logger.info("Adaptive transcoding completed successfully")
 
@@ -679,30 +1351,207 @@ def transcode_adaptive_variants(
         raise TranscodingError(f"Adaptive transcoding failed: {e}") from e
 
 
+# ==============================================================================
+# ASYNCIO ВАРИАНТ (для кода, уже работающего в event loop)
+# ==============================================================================
+
+async def _arun(cmd: List[str], timeout_sec: int = 600) -> None:
+    """Асинхронный аналог run() для FFmpeg: ждем процесс, не занимая поток
+
+    Проверка команды и лимит HLSFIELD_FFMPEG_CONCURRENCY - те же, что у run():
+    слот общего семафора ждется в потоке, чтобы не блокировать event loop.
+    """
+    _check_command(cmd)
+    cmd = _with_timelimit([ensure_binary_available(cmd[0], cmd[0]), *cmd[1:]], timeout_sec)
+    logger.debug(f"Executing command (async): {' '.join(cmd)}")
+
+    await asyncio.to_thread(_ffmpeg_slots.__enter__)
+    try:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError as e:
+            raise FFmpegNotFoundError(cmd[0]) from e
+
+        try:
+            _, stderr = await asyncio.wait_for(proc.communicate(), timeout_sec)
+        except asyncio.TimeoutError as e:
+            proc.kill()
+            await proc.wait()
+            raise TimeoutError(f"Command timed out after {timeout_sec} seconds", timeout_sec) from e
+    finally:
+        _ffmpeg_slots.__exit__(None, None, None)
+
+    if proc.returncode != 0:
+        _handle_ffmpeg_error(cmd, proc.returncode, "", stderr.decode("utf-8", errors="replace"))
+
+async def atranscode_hls_variants(
+    input_path: Path,
+    out_dir: Path,
+    ladder: List[Dict],
+    segment_duration: int = 6,
+    max_parallel: Optional[int] = None,
+) -> Path:
+    """Создает HLS адаптивный стрим из async кода
+
+    Варианты запускаются через asyncio.create_subprocess_exec и ждутся
+    параллельно - без пула потоков. Синхронный transcode_hls_variants
+    остается основным API (Celery задачи, сигналы).
+    """
+    try:
+        config = TranscodingConfig(StreamFormat.HLS, segment_duration)
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        # FFprobe синхронный (и кешируется) - уводим его из event loop
+        _, audio_stream, _, filtered_ladder = await asyncio.to_thread(
+            _prepare_transcoding, input_path, ladder
+        )
+        has_audio = audio_stream is not None
+        limit = asyncio.Semaphore(max_parallel or len(filtered_ladder))
+
+        async def encode(rung: Dict) -> HLSVariant:
+            async with limit:
+                cmd = _build_hls_variant_command(input_path, out_dir, rung, config, has_audio)
+                await _arun(cmd, timeout_sec=600)
+                return _collect_hls_variant(out_dir, rung, has_audio)
+
+        results = await asyncio.gather(
+            *(encode(rung) for rung in filtered_ladder), return_exceptions=True
+        )
+
+        variant_infos = []
+        for rung, result in zip(filtered_ladder, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to create {rung['height']}p HLS variant: {result}")
+                continue
+            variant_infos.append(result)
+
+        if not variant_infos:
+            raise TranscodingError("No HLS variants were successfully created")
+
+        return _create_master_playlist(out_dir, variant_infos)
+
+    except Exception as e:
+        logger.error(f"HLS transcoding failed: {e}")
+        if isinstance(e, (TranscodingError, ConfigurationError, InvalidVideoError)):
+            raise
+        raise TranscodingError(f"HLS transcoding failed: {e}") from e
+
+
+async def process_video_async(
+    input_path: Path,
+    storage,
+    base_key: str,
+    ladder: List[Dict],
+    segment_duration: int = 6,
+    preview_at: Optional[float] = None,
+    max_parallel: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Полный цикл для одного видео из async кода: HLS + превью + загрузка.
+
+    Превью извлекается параллельно с кодированием лестницы, а дерево HLS и
+    превью загружаются в storage одновременно - задержки FFmpeg и сети
+    перекрываются. Storage API Django синхронный, поэтому загрузка идет в
+    потоках (asyncio.to_thread), а не через отдельный async клиент.
+
+    Returns:
+        Dict: hls_master - ключ master плейлиста, preview - ключ превью
+        (None, если кадр извлечь не удалось), files - все загруженные ключи
+    """
+    if preview_at is None:
+        preview_at = defaults.DEFAULT_PREVIEW_AT
+    base_key = base_key.rstrip("/")
+
+    async def preview(out_image: Path) -> Optional[Path]:
+        # Без превью видео все равно пригодно - ошибка не роняет конвейер
+        try:
+            return await asyncio.to_thread(extract_preview, input_path, out_image, preview_at)
+        except Exception as e:
+            logger.warning(f"Preview extraction failed for {input_path}: {e}")
+            return None
+
+    with tempdir(prefix="hlsfield_async_") as td:
+        hls_dir = td / "hls"
+        master, preview_path = await asyncio.gather(
+            atranscode_hls_variants(input_path, hls_dir, ladder, segment_duration, max_parallel),
+            preview(td / "preview.jpg"),
+        )
+
+        uploads = [asyncio.to_thread(save_tree_to_storage, hls_dir, storage, base_key)]
+        if preview_path is not None:
+            uploads.append(
+                asyncio.to_thread(_save_with_retry, storage, f"{base_key}/{preview_path.name}", preview_path)
+            )
+        saved_tree, *saved_preview = await asyncio.gather(*uploads)
+
+    return {
+        "hls_master": f"{base_key}/{master.name}",
+        "preview": saved_preview[0] if saved_preview else None,
+        "files": saved_tree,
+    }
+
+
 # ==============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ==============================================================================
 
+# Меньше этого размера лестницы numpy только добавляет накладные расходы
+_NUMPY_LADDER_MIN = 8
+
+
 def _filter_ladder_by_source(ladder: List[Dict], source_height: int) -> List[Dict]:
     """Фильтрует лестницу качеств по исходному разрешению"""
-    filtered = [r for r in ladder if r["height"] <= source_height * 1.1]
+    limit = source_height * 1.1
+
+    if np is None or len(ladder) < _NUMPY_LADDER_MIN:
+        filtered = [r for r in ladder if r["height"] <= limit]
 
-    if not filtered:
-        filtered = [min(ladder, key=lambda x: x["height"])]
+        if not filtered:
+            filtered = [min(ladder, key=lambda x: x["height"])]
+            logger.warning(f"All ladder heights exceed source {source_height}p, using lowest")
+
+        return sorted(filtered, key=lambda x: x["height"])
+
+    heights = np.fromiter((r["height"] for r in ladder), dtype=np.int32, count=len(ladder))
+    keep = heights <= limit
+    if not keep.any():
+        keep[heights.argmin()] = True
         logger.warning(f"All ladder heights exceed source {source_height}p, using lowest")
 
-    return sorted(filtered, key=lambda x: x["height"])
+    idx = np.flatnonzero(keep)
+    idx = idx[np.argsort(heights[idx], kind="stable")]
+    return [ladder[i] for i in idx]
 
 def _cleanup_dash_files_from_current_dir():
     """Очищает лишние DASH файлы из текущей директории"""
     # Заглушка для совместимости с существующим кодом
     pass
 
-def analyze_video_complexity(input_path: Path) -> Dict[str, Any]:
-    """Анализирует сложность видео для оптимизации битрейта"""
-    # Заглушка для функции из tasks.py
+def analyze_video_complexity(
+    input_path: Path, *, streams: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Анализирует сложность видео для оптимизации битрейта
+
+    streams - уже полученный результат ffprobe_streams(input_path): вызывающий,
+    который все равно анализирует файл, передает его, и FFprobe не запускается.
+    """
+    if streams is None:
+        try:
+            streams = ffprobe_streams(input_path)
+        except Exception as e:
+            logger.warning(f"Complexity analysis could not probe {input_path}: {e}")
+            streams = {}
+
+    try:
+        duration = float(streams.get("format", {}).get("duration", 0))
+    except (TypeError, ValueError):
+        duration = 0
+
+    # Оценка сложности сцены пока не реализована - значения по умолчанию
     return {
-        "duration": 0,
+        "duration": duration,
         "complexity": "medium",
         "motion_level": 0.5,
         "detail_level": 0.5,
@@ -714,6 +1563,36 @@ def analyze_video_complexity(input_path: Path) -> Dict[str, Any]:
 # ==============================================================================
 
 
+_COPY_CHUNK = 4 * 1024 * 1024  # 4 MiB
+
+
+def _copy_file_object(src, out) -> None:
+    """Копирует src в out; для настоящих файлов - в ядре через copy_file_range
+
+    Объекты storage без fileno() (S3, in-memory) копируются через буфер 4 MiB.
+    """
+    try:
+        src_fd, dst_fd = src.fileno(), out.fileno()
+    except (AttributeError, OSError, ValueError):
+        src_fd = dst_fd = None
+
+    if isinstance(src_fd, int) and isinstance(dst_fd, int) and hasattr(os, "copy_file_range"):
+        copied = 0
+        try:
+            while True:
+                n = os.copy_file_range(src_fd, dst_fd, _COPY_CHUNK)
+                if not n:
+                    return
+                copied += n
+        except OSError:
+            # Ядро/ФС не поддерживают (старый Linux, разные ФС) - копируем
+            # буфером, но только если еще ничего не записали
+            if copied:
+                raise
+
+    shutil.copyfileobj(src, out, length=_COPY_CHUNK)
+
+
 def pull_to_local(storage, name: str, dst_dir: Path) -> Path:
     """Загружает файл из storage в локальную директорию"""
     try:
@@ -732,7 +1611,7 @@ def pull_to_local(storage, name: str, dst_dir: Path) -> Path:
 
         with storage.open(name, "rb") as src:
             with dst.open("wb") as out:
-                shutil.copyfileobj(src, out, length=defaults.MAX_FILE_SIZE)
+                _copy_file_object(src, out)
 
         if not dst.exists() or dst.stat().st_size == 0:
             raise StorageError(f"Downloaded file is empty: {dst}")
@@ -752,26 +1631,73 @@ def pull_to_local(storage, name: str, dst_dir: Path) -> Path:
         raise StorageError(f"Cannot download file {name}: {e}") from e
 
 
-def save_tree_to_storage(local_root: Path, storage, base_path: str) -> List[str]:
-    """Рекурсивно сохраняет дерево файлов в storage"""
-    saved_paths = []
+# Сетевые сбои, которые имеет смысл повторять; остальные ошибки storage - сразу наверх
+_TRANSIENT_STORAGE_ERRORS = (ConnectionError, socket.timeout) + _BOTO_TRANSIENT_ERRORS
+_STORAGE_SAVE_ATTEMPTS = 3
+_RETRY_BASE_DELAY = 0.5
+_RETRY_MAX_DELAY = 8.0
+
+# Точка подмены для тестов: ретраи не должны реально спать
+_sleep = time.sleep
+
+
+def _save_with_retry(storage, storage_key: str, local_file_path: Path) -> str:
+    """storage.save с экспоненциальной задержкой и jitter на сетевых сбоях"""
+    for attempt in range(_STORAGE_SAVE_ATTEMPTS - 1):
+        try:
+            # Файл открывается заново - неудачная попытка могла прочитать его частично
+            with local_file_path.open("rb") as fh:
+                return storage.save(storage_key, fh)
+        except _TRANSIENT_STORAGE_ERRORS as e:
+            # Jitter разводит повторы параллельных загрузок во времени
+            delay = min(_RETRY_MAX_DELAY, _RETRY_BASE_DELAY * 2 ** attempt)
+            delay += random.uniform(0, _RETRY_BASE_DELAY)
+            logger.warning(f"Transient error saving {storage_key} ({e}), retrying in {delay:.2f}s")
+            _sleep(delay)
+
+    # Последняя попытка: ошибка уходит вызывающему как есть
+    with local_file_path.open("rb") as fh:
+        return storage.save(storage_key, fh)
+
+
+def save_tree_to_storage(
+    local_root: Path, storage, base_path: str, max_workers: Optional[int] = None
+) -> List[str]:
+    """Рекурсивно сохраняет дерево файлов в storage
+
+    Файлы загружаются параллельно: для S3/GCS каждый save - сетевой round-trip,
+    и десятки сегментов последовательно упираются в латентность. Порядок
+    результата совпадает с порядком обхода дерева. Глубина параллелизма по
+    умолчанию - HLSFIELD_STORAGE_IO_WORKERS.
+    """
+    if max_workers is None:
+        max_workers = defaults.STORAGE_IO_WORKERS
 
     try:
+        jobs = []
         for root, dirs, files in os.walk(local_root):
             for filename in files:
                 local_file_path = Path(root) / filename
                 rel_path = local_file_path.relative_to(local_root)
                 storage_key = f"{base_path.rstrip('/')}/{str(rel_path).replace(os.sep, '/')}"
+                jobs.append((local_file_path, storage_key))
 
-                logger.debug(f"Saving {local_file_path} -> {storage_key}")
+        def save_one(job: Tuple[Path, str]) -> str:
+            local_file_path, storage_key = job
+            logger.debug(f"Saving {local_file_path} -> {storage_key}")
+            try:
+                return _save_with_retry(storage, storage_key, local_file_path)
+            except Exception as e:
+                logger.error(f"Failed to save {storage_key}: {e}")
+                raise StorageError(f"Cannot save file {storage_key}: {e}") from e
 
-                try:
-                    with local_file_path.open("rb") as fh:
-                        saved_name = storage.save(storage_key, fh)
-                        saved_paths.append(saved_name)
-                except Exception as e:
-                    logger.error(f"Failed to save {storage_key}: {e}")
-                    raise StorageError(f"Cannot save file {storage_key}: {e}") from e
+        if len(jobs) <= 1 or max_workers <= 1:
+            saved_paths = [save_one(job) for job in jobs]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(max_workers, len(jobs)), thread_name_prefix="hlsfield-upload"
+            ) as executor:
+                saved_paths = list(executor.map(save_one, jobs))
 
         logger.info(f"Saved {len(saved_paths)} files to storage under {base_path}")
         return saved_paths
@@ -788,8 +1714,46 @@ def save_tree_to_storage(local_root: Path, storage, base_path: str) -> List[str]
 # ==============================================================================
 
 
+_HEADER_SNIFF_BYTES = 256
+_ASF_GUID = bytes.fromhex("3026b2758e66cf11a6d900aa0062ce6c")
+# Первые боксы QuickTime/MP4 (старые .mov начинаются не с ftyp)
+_MP4_LEADING_BOXES = frozenset({b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip", b"pnot"})
+
+
+def _sniff_container(path: Path) -> Optional[str]:
+    """Определяет контейнер по сигнатуре в начале файла (None - не распознан)
+
+    Читается только заголовок: проверка не зависит от размера файла.
+    """
+    with path.open("rb") as f:
+        header = f.read(_HEADER_SNIFF_BYTES)
+
+    if header[4:8] in _MP4_LEADING_BOXES:
+        return "mp4"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "matroska"
+    if header[:4] == b"RIFF" and header[8:12] == b"AVI ":
+        return "avi"
+    if header[:16] == _ASF_GUID:
+        return "asf"
+    if header[:3] == b"FLV":
+        return "flv"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:4] == b"\x00\x00\x01\xba":
+        return "mpeg"
+    if header[:1] == b"\x47" and header[188:189] in (b"", b"\x47"):
+        return "mpegts"
+    return None
+
+
 def validate_video_file(file_path: Union[str, Path]) -> Dict[str, Any]:
-    """Выполняет базовую валидацию видеофайла"""
+    """Выполняет базовую валидацию видеофайла
+
+    Контейнер определяется по сигнатуре. Незнакомая сигнатура - только
+    предупреждение: решение принимает FFprobe (M2TS и прочие форматы,
+    которых нет в _sniff_container).
+    """
     path = Path(file_path)
 
     validation = {"valid": False, "issues": [], "warnings": [], "info": {}}
@@ -813,9 +1777,19 @@ def validate_video_file(file_path: Union[str, Path]) -> Dict[str, Any]:
     ext = path.suffix.lower()
     validation["info"]["extension"] = ext
 
-    if ext not in defaults.ALLOWED_EXTENSIONS:
+    if ext not in defaults.ALLOWED_EXTENSIONS_SET:
         validation["issues"].append(f"Unsupported file extension: {ext}")
 
+    try:
+        container = _sniff_container(path)
+    except OSError as e:
+        validation["issues"].append(f"Cannot read file: {e}")
+        return validation
+
+    validation["info"]["container"] = container
+    if container is None:
+        validation["warnings"].append("Unrecognized video container signature")
+
     # Анализируем через FFprobe
     try:
         info = ffprobe_streams(path)
@@ -867,17 +1841,24 @@ __all__ = [
     "tempdir",
     # Выполнение команд
     "run",
+    "RunResult",
     "ensure_binary_available",
     # Анализ видео
     "ffprobe_streams",
+    "ffprobe_streams_batch",
+    "clear_probe_cache",
     "pick_video_audio_streams",
     "get_video_info_quick",
     # Превью
     "extract_preview",
+    "extract_previews_multi",
     # Транскодинг
     "transcode_hls_variants",
     "transcode_dash_variants",
     "transcode_adaptive_variants",
+    "atranscode_hls_variants",
+    "process_video_async",
+    "HLSVariant",
     # Storage
     "pull_to_local",
     "save_tree_to_storage",
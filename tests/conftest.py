@@ -4,13 +4,20 @@ Pytest конфигурация для django-hlsfield тестов
 import os
 import sys
 import tempfile
+from contextlib import nullcontext
 from pathlib import Path
-from unittest.mock import Mock
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
 
 import django
 import pytest
 from django.conf import settings
 
+try:
+    import django_perf_rec
+except ImportError:
+    django_perf_rec = None
+
 # Добавляем путь к src для импортов
 sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
 
@@ -24,18 +31,83 @@ def pytest_configure():
 
 
 @pytest.fixture(scope='session')
-def django_db_setup():
-    """Настройка тестовой БД"""
-    settings.DATABASES['default'] = {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': ':memory:',
-    }
+def django_db_setup(django_db_setup, django_db_blocker):
+    """Тестовая БД + таблица VideoEvent"""
+    from django.db import connection
+    from hlsfield.views import VideoEvent
+
+    # У hlsfield нет models.py, поэтому syncdb пропускает приложение
+    # и VideoEvent (объявлена в views) остается без таблицы
+    with django_db_blocker.unblock(), connection.schema_editor() as editor:
+        editor.create_model(VideoEvent)
+
+
+@pytest.fixture(autouse=True, scope='session')
+def _warm_imports():
+    """Импортирует граф модулей задач один раз при старте сессии (и xdist воркера)"""
+    import hlsfield.tasks  # noqa: F401
+    import hlsfield.utils  # noqa: F401
+    import hlsfield.views  # noqa: F401
+
+
+@pytest.fixture(autouse=True, scope='session')
+def _no_ffmpeg():
+    """Подменяет hlsfield.utils.run один раз на всю сессию - тесты не запускают FFmpeg
+
+    Поведение по умолчанию перед каждым тестом задает _reset_no_ffmpeg.
+    """
+    with patch('hlsfield.utils.run') as mock_run:
+        yield mock_run
 
 
 @pytest.fixture(autouse=True)
-def enable_db_access_for_all_tests(db):
-    """Разрешаем доступ к БД для всех тестов"""
-    pass
+def _reset_no_ffmpeg(_no_ffmpeg):
+    """Сбрасывает сессионный mock run: история вызовов и настройки теста не протекают"""
+    from hlsfield.utils import RunResult
+
+    _no_ffmpeg.reset_mock(return_value=True, side_effect=True)
+    _no_ffmpeg.return_value = RunResult(0, '{"streams":[],"format":{}}', '')
+
+
+@pytest.fixture(autouse=True, scope='session')
+def _no_retry_sleep():
+    """Ретраи в hlsfield.utils не спят в тестах"""
+    with patch('hlsfield.utils._sleep') as mock_sleep:
+        yield mock_sleep
+
+
+@pytest.fixture(autouse=True)
+def _fresh_probe_cache():
+    """Сбрасывает кеш ffprobe_streams - ответы подмененного run не протекают между тестами"""
+    from hlsfield.utils import clear_probe_cache
+    clear_probe_cache()
+
+
+@pytest.fixture(scope='session')
+def checks_ran():
+    """Запускает Django system checks один раз на всю сессию"""
+    from django.core.management import call_command
+
+    # Фиксируем DB/cache операции проверок: лишние импорты при старте
+    # (например, запросы к БД из ready()) ломают сравнение с baseline
+    if django_perf_rec is not None:
+        recorder = django_perf_rec.record(
+            record_name='system_checks',
+            path=str(Path(__file__).parent / 'perf' / 'checks.perf.yml'),
+        )
+    else:
+        recorder = nullcontext()
+
+    # Вывод проверок никто не читает - сразу отправляем его в devnull
+    with open(os.devnull, 'w') as devnull:
+        try:
+            with recorder:
+                call_command('check', stdout=devnull, stderr=devnull, verbosity=0)
+        except Exception as e:
+            # В тестовом окружении FFmpeg может отсутствовать - это нормально
+            if "FFmpeg" not in str(e):
+                raise
+    return True
 
 
 @pytest.fixture
@@ -59,7 +131,7 @@ def temp_video_file():
 @pytest.fixture
 def mock_ffmpeg(monkeypatch):
     """Мокает FFmpeg команды"""
-    from subprocess import CompletedProcess
+    from hlsfield.utils import RunResult
 
     def mock_run(cmd, *args, **kwargs):
         # Эмулируем разные команды
@@ -70,7 +142,7 @@ def mock_ffmpeg(monkeypatch):
 
         # Для echo команд
         if len(cmd) > 0 and ('echo' in cmd[0] or 'echo' in str(cmd)):
-            return CompletedProcess(args=cmd, returncode=0, stdout='hello', stderr='')
+            return RunResult(0, 'hello', '')
 
         if len(cmd) > 0 and 'ffprobe' in cmd[0]:
             output = '''{
@@ -89,11 +161,11 @@ def mock_ffmpeg(monkeypatch):
                     "bit_rate": "1333333"
                 }
             }'''
-            return CompletedProcess(args=cmd, returncode=0, stdout=output, stderr='')
+            return RunResult(0, output, '')
 
         # Для echo команд
         if len(cmd) > 0 and 'echo' in cmd[0]:
-            return CompletedProcess(args=cmd, returncode=0, stdout='hello', stderr='')
+            return RunResult(0, 'hello', '')
 
         # Для sleep команд - эмулируем таймаут
         if len(cmd) > 0 and 'sleep' in str(cmd):
@@ -101,7 +173,7 @@ def mock_ffmpeg(monkeypatch):
             raise subprocess.TimeoutExpired(' '.join(cmd), 1)
 
         # По умолчанию успех
-        return CompletedProcess(args=cmd, returncode=0, stdout='', stderr='')
+        return RunResult(0, '', '')
 
     def mock_ensure_binary(binary_name, path):
         # Для несуществующих команд
@@ -139,6 +211,41 @@ def sample_ladder():
     ]
 
 
+@pytest.fixture
+def video_mocks():
+    """Граф модель/экземпляр/поле/файл для тестов задач - свежий на каждый тест"""
+    # Поле, файл и storage - просто наборы атрибутов, Mock для них не нужен
+    mock_field = SimpleNamespace(
+        ladder=[
+            {"height": 360, "v_bitrate": 800, "a_bitrate": 96},
+            {"height": 720, "v_bitrate": 2500, "a_bitrate": 128},
+        ],
+        segment_duration=6,
+        hls_playlist_field='hls_master',
+        dash_manifest_field='dash_manifest',
+        hls_base_subdir='hls',
+        dash_base_subdir='dash',
+        adaptive_base_subdir='adaptive',
+    )
+    mock_file = SimpleNamespace(name='videos/test_video.mp4')
+    mock_storage = SimpleNamespace()
+
+    mock_instance = Mock()
+    mock_instance.pk = 1
+
+    mock_model = Mock()
+    mock_model.objects.get.return_value = mock_instance
+
+    return SimpleNamespace(
+        mock_model=mock_model,
+        mock_instance=mock_instance,
+        mock_field=mock_field,
+        mock_file=mock_file,
+        mock_storage=mock_storage,
+        resolve_tuple=(mock_field, mock_file, mock_storage, mock_file.name),
+    )
+
+
 @pytest.fixture
 def mock_video_file():
     """Создает mock видео файла для тестов"""
@@ -1,10 +1,9 @@
 import pytest
-from django.test import TestCase
 
 from hlsfield import VideoField, HLSVideoField
 
 
-class TestBasicImports(TestCase):
+class TestBasicImports:
     """Тесты базового импорта и функциональности"""
 
     def test_imports(self):
@@ -39,7 +38,7 @@ class TestBasicImports(TestCase):
         assert hasattr(hlsfield, 'FFmpegError')
 
 
-class TestVideoFieldBasics(TestCase):
+class TestVideoFieldBasics:
     """Базовые тесты полей"""
 
     def test_field_creation(self):
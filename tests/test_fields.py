@@ -265,6 +265,15 @@ class TestOptimalLadder(SimpleTestCase):
         for rung in ladder:
             self.assertLessEqual(rung['height'], max_allowed_height)
 
+    def test_optimal_ladder_returns_copies(self):
+        """Изменение результата не портит базовую лестницу"""
+        ladder = get_optimal_ladder_for_resolution(100, 100)
+        self.assertEqual(ladder[0]['height'], 240)
+        ladder[0]['v_bitrate'] = 1
+
+        self.assertEqual(get_optimal_ladder_for_resolution(100, 100)[0]['v_bitrate'], 300)
+        self.assertEqual([r['height'] for r in get_optimal_ladder_for_resolution(1280, 720)], [240, 360, 480, 720])
+
     def test_optimal_ladder_structure(self):
         """Тест структуры сгенерированной лестницы"""
         ladder = get_optimal_ladder_for_resolution(1920, 1080)
@@ -3,399 +3,385 @@ Smoke тесты для django-hlsfield
 
 Эти тесты проверяют основную функциональность и должны выполняться быстро.
 Используются для первичной проверки что пакет работает корректно.
-"""
 
-import pytest
-from django.test import TestCase
-from django.core.exceptions import ImproperlyConfigured
+Все классы - обычные pytest классы без django.test.TestCase:
+им не нужна БД, а Django поднимается один раз на сессию через conftest.py.
+"""
 
+import importlib.util
+import re
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
 
-class TestPackageStructure(TestCase):
+import pytest
+from django.apps import apps
+from django.db import models
+from django.template import TemplateDoesNotExist
+from django.template.loader import select_template
+
+import hlsfield
+from hlsfield import (
+    AdaptiveVideoField,
+    ConfigurationError,
+    DASHVideoField,
+    FFmpegError,
+    HLSFieldError,
+    HLSVideoField,
+    InvalidVideoError,
+    StorageError,
+    VideoField,
+    defaults,
+    get_optimal_ladder_for_resolution,
+    utils,
+    validate_ladder,
+)
+from hlsfield.defaults import clear_runtime_cache, get_runtime_info, validate_settings
+from hlsfield.helpers import (
+    format_bitrate,
+    format_duration,
+    format_file_size,
+    generate_video_id,
+    video_upload_to,
+)
+
+
+# Паттерны компилируются один раз на модуль
+_VERSION_RE = re.compile(r'^\d+\.\d+\.\d+')
+
+# Тестовая модель объявляется один раз: повторный импорт модуля в том же
+# процессе берет уже зарегистрированный класс из реестра приложений
+if 'smokevideomodel' not in apps.all_models['tests']:
+    class SmokeVideoModel(models.Model):
+        video = VideoField(upload_to="videos/")
+
+        class Meta:
+            app_label = 'tests'
+else:
+    SmokeVideoModel = apps.get_registered_model('tests', 'smokevideomodel')
+
+
+@lru_cache(maxsize=None)
+def _ladder(width, height):
+    """Кеширует лестницу для разрешения: входы - небольшой фиксированный набор"""
+    return get_optimal_ladder_for_resolution(width, height)
+
+
+class TestPackageStructure:
     """Тесты структуры пакета"""
 
     def test_package_imports(self):
         """Основные импорты работают"""
-        import hlsfield
-
-        # Проверяем что основные классы доступны
-        from hlsfield import VideoField, HLSVideoField, DASHVideoField, AdaptiveVideoField
-        from hlsfield import validate_ladder, get_optimal_ladder_for_resolution
-        from hlsfield import HLSFieldError, FFmpegError, InvalidVideoError
-
-        # Все импорты прошли успешно
-        self.assertTrue(True)
+        # Сами импорты выполняются на уровне модуля - здесь проверяем экспорт
+        for obj in (
+            VideoField, HLSVideoField, DASHVideoField, AdaptiveVideoField,
+            validate_ladder, get_optimal_ladder_for_resolution,
+            HLSFieldError, FFmpegError, InvalidVideoError,
+        ):
+            assert obj.__name__ in hlsfield.__all__
 
     def test_version_available(self):
         """Версия пакета доступна"""
-        import hlsfield
+        # Читаем только METADATA дистрибутива - код пакета не выполняется
+        try:
+            package_version = version('django-hlsfield')
+        except PackageNotFoundError:
+            pytest.skip("django-hlsfield не установлен (pip install -e .)")
 
-        self.assertTrue(hasattr(hlsfield, '__version__'))
-        self.assertIsInstance(hlsfield.__version__, str)
-        self.assertRegex(hlsfield.__version__, r'^\d+\.\d+\.\d+')
+        assert _VERSION_RE.match(package_version)
 
     def test_django_app_config(self):
         """Django app сконфигурирован правильно"""
-        from django.apps import apps
-
         # Проверяем что app зарегистрирован
         app_config = apps.get_app_config('hlsfield')
-        self.assertEqual(app_config.name, 'hlsfield')
-        self.assertEqual(app_config.verbose_name, 'HLS Video Fields')
+        assert app_config.name == 'hlsfield'
+        assert app_config.verbose_name == 'HLS Video Fields'
 
 
-class TestBasicFieldCreation(TestCase):
+class TestBasicFieldCreation:
     """Тесты создания полей"""
 
     def test_video_field_creation(self):
         """VideoField создается без ошибок"""
-        from hlsfield import VideoField
-
         field = VideoField(upload_to="videos/")
-        self.assertIsNotNone(field)
-        self.assertEqual(field.upload_to, "videos/")
+        assert field is not None
+        assert field.upload_to == "videos/"
 
     def test_hls_field_creation(self):
         """HLSVideoField создается без ошибок"""
-        from hlsfield import HLSVideoField
-
         field = HLSVideoField(upload_to="videos/")
-        self.assertIsNotNone(field)
-        self.assertTrue(hasattr(field, 'ladder'))
-        self.assertTrue(hasattr(field, 'segment_duration'))
+        assert field is not None
+        # ladder - property класса, segment_duration - атрибут экземпляра
+        missing = {'ladder', 'segment_duration'} - {*vars(field), *vars(HLSVideoField)}
+        assert not missing, missing
 
     def test_dash_field_creation(self):
         """DASHVideoField создается без ошибок"""
-        from hlsfield import DASHVideoField
-
         field = DASHVideoField(upload_to="videos/")
-        self.assertIsNotNone(field)
-        self.assertTrue(hasattr(field, 'dash_manifest_field'))
+        assert field is not None
+        assert 'dash_manifest_field' in vars(field)
 
     def test_adaptive_field_creation(self):
         """AdaptiveVideoField создается без ошибок"""
-        from hlsfield import AdaptiveVideoField
-
         field = AdaptiveVideoField(upload_to="videos/")
-        self.assertIsNotNone(field)
-        self.assertTrue(hasattr(field, 'hls_playlist_field'))
-        self.assertTrue(hasattr(field, 'dash_manifest_field'))
+        assert field is not None
+        missing = {'hls_playlist_field', 'dash_manifest_field'} - vars(field).keys()
+        assert not missing, missing
 
 
-class TestUtilityFunctions(TestCase):
+class TestUtilityFunctions:
     """Тесты утилитарных функций"""
 
     def test_validate_ladder_basic(self):
         """validate_ladder работает с корректными данными"""
-        from hlsfield import validate_ladder
-
         ladder = [
             {"height": 360, "v_bitrate": 800, "a_bitrate": 96},
             {"height": 720, "v_bitrate": 2500, "a_bitrate": 128},
         ]
 
         # Не должно вызывать исключений
-        result = validate_ladder(ladder)
-        self.assertTrue(result)
+        assert validate_ladder(ladder)
 
-    def test_validate_ladder_invalid(self):
+    @pytest.mark.parametrize("bad,message", [
+        ([], "non-empty list"),  # Пустая лестница
+        ([{"height": 360, "v_bitrate": 800}], "missing required field: a_bitrate"),
+    ])
+    def test_validate_ladder_invalid(self, bad, message):
         """validate_ladder выбрасывает ошибки для некорректных данных"""
-        from hlsfield import validate_ladder
-
-        # Пустая лестница
-        with self.assertRaises(ValueError):
-            validate_ladder([])
+        with pytest.raises(ValueError, match=message):
+            validate_ladder(bad)
 
-        # Отсутствующие поля
-        with self.assertRaises(ValueError):
-            validate_ladder([{"height": 360, "v_bitrate": 800}])  # Нет a_bitrate
-
-    def test_optimal_ladder_generation(self):
+    @pytest.mark.parametrize("width,height", [(1920, 1080), (1280, 720), (640, 360)])
+    def test_optimal_ladder_generation(self, width, height):
         """get_optimal_ladder_for_resolution генерирует валидные лестницы"""
-        from hlsfield import get_optimal_ladder_for_resolution, validate_ladder
-
-        # Тестируем разные разрешения
-        for width, height in [(1920, 1080), (1280, 720), (640, 360)]:
-            ladder = get_optimal_ladder_for_resolution(width, height)
+        ladder = _ladder(width, height)
 
-            # Лестница не пустая
-            self.assertGreater(len(ladder), 0)
+        # Лестница не пустая
+        assert len(ladder) > 0
 
-            # Лестница валидная
-            self.assertTrue(validate_ladder(ladder))
+        # Лестница валидная
+        assert validate_ladder(ladder)
 
-            # Качества не превышают исходное разрешение (с запасом)
-            max_height = max(rung['height'] for rung in ladder)
-            self.assertLessEqual(max_height, height * 1.2)
+        # Качества не превышают исходное разрешение (с запасом)
+        max_height = max(rung['height'] for rung in ladder)
+        assert max_height <= height * 1.2
 
 
-class TestExceptionHierarchy(TestCase):
+class TestExceptionHierarchy:
     """Тесты иерархии исключений"""
 
     def test_exception_inheritance(self):
         """Проверяем правильность наследования исключений"""
-        from hlsfield import (
-            HLSFieldError, FFmpegError, InvalidVideoError,
-            StorageError, ConfigurationError
-        )
-
         # Все исключения должны наследоваться от HLSFieldError
-        self.assertTrue(issubclass(FFmpegError, HLSFieldError))
-        self.assertTrue(issubclass(InvalidVideoError, HLSFieldError))
-        self.assertTrue(issubclass(StorageError, HLSFieldError))
-        self.assertTrue(issubclass(ConfigurationError, HLSFieldError))
+        assert issubclass(FFmpegError, HLSFieldError)
+        assert issubclass(InvalidVideoError, HLSFieldError)
+        assert issubclass(StorageError, HLSFieldError)
+        assert issubclass(ConfigurationError, HLSFieldError)
 
     def test_exception_creation(self):
         """Исключения создаются корректно"""
-        from hlsfield import HLSFieldError, FFmpegError, InvalidVideoError
-
         # Базовое исключение
         base_error = HLSFieldError("Test error")
-        self.assertEqual(str(base_error), "Test error")
+        assert str(base_error) == "Test error"
 
         # FFmpeg ошибка
         ffmpeg_error = FFmpegError(["ffmpeg", "-i", "test.mp4"], 1, "", "Error")
-        self.assertIn("ffmpeg", str(ffmpeg_error))
+        assert "ffmpeg" in str(ffmpeg_error)
 
         # Ошибка видео
         video_error = InvalidVideoError("Invalid video file")
-        self.assertIn("Invalid video file", str(video_error))
+        assert "Invalid video file" in str(video_error)
 
 
-class TestHelperFunctions(TestCase):
+class TestHelperFunctions:
     """Тесты вспомогательных функций"""
 
     def test_video_upload_to(self):
         """video_upload_to генерирует корректные пути"""
-        from hlsfield.helpers import video_upload_to
-
         path = video_upload_to(None, "test_video.mp4")
 
-        self.assertTrue(path.startswith("videos/"))
-        self.assertTrue(path.endswith(".mp4"))
-        self.assertEqual(len(path.split("/")), 3)  # videos/uuid/filename
+        assert path.startswith("videos/")
+        assert path.endswith(".mp4")
+        assert len(path.split("/")) == 3  # videos/uuid/filename
 
-    def test_generate_video_id(self):
+    @pytest.mark.parametrize("length", [4, 8, 16])
+    def test_generate_video_id(self, length):
         """generate_video_id работает корректно"""
-        from hlsfield.helpers import generate_video_id
-
-        # Проверяем разные длины
-        for length in [4, 8, 16]:
-            video_id = generate_video_id(length)
-            self.assertEqual(len(video_id), length)
-            self.assertTrue(video_id.isalnum())
-
-    def test_format_functions(self):
-        """Функции форматирования работают корректно"""
-        from hlsfield.helpers import format_duration, format_file_size, format_bitrate
+        video_id = generate_video_id(length)
+        assert len(video_id) == length
+        assert video_id.isalnum()
 
+    @pytest.mark.parametrize("fn,arg,expected", [
         # Длительность
-        self.assertEqual(format_duration(0), "0:00")
-        self.assertEqual(format_duration(65), "1:05")
-        self.assertEqual(format_duration(3661), "1:01:01")
-
+        (format_duration, 0, "0:00"),
+        (format_duration, 65, "1:05"),
+        (format_duration, 3661, "1:01:01"),
         # Размер файла
-        self.assertEqual(format_file_size(1024), "1.0 KB")
-        self.assertEqual(format_file_size(1048576), "1.0 MB")
-
+        (format_file_size, 1024, "1.0 KB"),
+        (format_file_size, 1048576, "1.0 MB"),
         # Битрейт
-        self.assertEqual(format_bitrate(1000), "1.0 Kbps")
-        self.assertEqual(format_bitrate(1000000), "1.0 Mbps")
+        (format_bitrate, 1000, "1.0 Kbps"),
+        (format_bitrate, 1000000, "1.0 Mbps"),
+    ])
+    def test_format_functions(self, fn, arg, expected):
+        """Функции форматирования работают корректно"""
+        assert fn(arg) == expected
 
 
-class TestDefaultSettings(TestCase):
+class TestDefaultSettings:
     """Тесты настроек по умолчанию"""
 
     def test_default_settings_accessible(self):
         """Настройки по умолчанию доступны"""
-        from hlsfield import defaults
-
-        # Проверяем основные настройки
-        self.assertTrue(hasattr(defaults, 'FFMPEG'))
-        self.assertTrue(hasattr(defaults, 'FFPROBE'))
-        self.assertTrue(hasattr(defaults, 'DEFAULT_LADDER'))
-        self.assertTrue(hasattr(defaults, 'SEGMENT_DURATION'))
+        # Проверяем основные настройки одним чтением словаря модуля
+        missing = {'FFMPEG', 'FFPROBE', 'DEFAULT_LADDER', 'SEGMENT_DURATION'} - vars(defaults).keys()
+        assert not missing, missing
 
         # Проверяем типы
-        self.assertIsInstance(defaults.FFMPEG, str)
-        self.assertIsInstance(defaults.DEFAULT_LADDER, list)
-        self.assertIsInstance(defaults.SEGMENT_DURATION, int)
+        assert isinstance(defaults.FFMPEG, str)
+        assert isinstance(defaults.DEFAULT_LADDER, list)
+        assert isinstance(defaults.SEGMENT_DURATION, int)
 
     def test_default_ladder_valid(self):
         """Лестница по умолчанию валидна"""
-        from hlsfield import defaults, validate_ladder
-
         # Лестница должна быть валидной
-        self.assertTrue(validate_ladder(defaults.DEFAULT_LADDER))
+        assert validate_ladder(defaults.DEFAULT_LADDER)
 
         # Должна содержать разумные значения
-        self.assertGreater(len(defaults.DEFAULT_LADDER), 0)
+        assert len(defaults.DEFAULT_LADDER) > 0
         for rung in defaults.DEFAULT_LADDER:
-            self.assertIn('height', rung)
-            self.assertIn('v_bitrate', rung)
-            self.assertIn('a_bitrate', rung)
+            assert 'height' in rung
+            assert 'v_bitrate' in rung
+            assert 'a_bitrate' in rung
 
 
-class TestDjangoIntegration(TestCase):
-    """Тесты интеграции с Django"""
+class TestDjangoIntegration:
+    """Тесты интеграции с Django (к БД не обращаются)"""
 
     def test_field_in_model(self):
         """Поля работают в Django моделях"""
-        from django.db import models
-        from hlsfield import VideoField
-
-        # Создаем тестовую модель
-        class TestModel(models.Model):
-            video = VideoField(upload_to="videos/")
-
-            class Meta:
-                app_label = 'tests'
-                db_table = 'test_video_unique'  # Уникальное имя таблицы
         # Модель создается без ошибок
-        self.assertTrue(hasattr(TestModel, 'video'))
+        assert hasattr(SmokeVideoModel, 'video')
 
         # Поле имеет правильный тип
-        field = TestModel._meta.get_field('video')
-        self.assertIsInstance(field, VideoField)
+        field = SmokeVideoModel._meta.get_field('video')
+        assert isinstance(field, VideoField)
 
     def test_admin_integration(self):
         """Проверяем что admin интеграция работает"""
-        try:
-            from django.contrib import admin
-            from hlsfield.views import VideoEvent
-
-            # Если VideoEvent зарегистрирован в admin, это не должно вызывать ошибок
-            admin_class = admin.site._registry.get(VideoEvent)
-            if admin_class:
-                self.assertTrue(hasattr(admin_class, 'list_display'))
-        except ImportError:
-            # Если модель не найдена, это нормально для smoke тестов
-            pass
+        # Без admin или модели VideoEvent тест пропускается
+        admin = pytest.importorskip('django.contrib.admin')
+        VideoEvent = pytest.importorskip('hlsfield.views').VideoEvent
 
+        # Если VideoEvent зарегистрирован в admin, это не должно вызывать ошибок
+        admin_class = admin.site._registry.get(VideoEvent)
+        if admin_class:
+            assert hasattr(admin_class, 'list_display')
 
-class TestTemplatesAndStatic(TestCase):
+
+class TestTemplatesAndStatic:
     """Тесты шаблонов и статических файлов"""
 
     def test_templates_exist(self):
         """Шаблоны плееров существуют"""
-        from django.template.loader import get_template
-        from django.template import TemplateDoesNotExist
-
         templates = [
             'hlsfield/players/hls_player.html',
             'hlsfield/players/dash_player.html',
             'hlsfield/players/universal_player.html',
         ]
 
-        for template_name in templates:
-            try:
-                template = get_template(template_name)
-                self.assertIsNotNone(template)
-            except TemplateDoesNotExist:
-                # В smoke тестах это может быть нормально
-                pass
+        # select_template останавливается на первом найденном шаблоне
+        try:
+            assert select_template(templates) is not None
+        except TemplateDoesNotExist:
+            # В smoke тестах это может быть нормально
+            pass
 
 
-class TestConfigurationValidation(TestCase):
+class TestConfigurationValidation:
     """Тесты валидации конфигурации"""
 
+    @pytest.mark.slow
     def test_runtime_info(self):
         """Получение runtime информации работает"""
-        from hlsfield.defaults import get_runtime_info, validate_settings
-
         # Получаем runtime информацию
         info = get_runtime_info()
-        self.assertIsInstance(info, dict)
-        self.assertIn('ffmpeg', info)
-        self.assertIn('processing', info)
+        assert isinstance(info, dict)
+        assert 'ffmpeg' in info
+        assert 'processing' in info
 
         # Валидация настроек
         issues = validate_settings()
-        self.assertIsInstance(issues, list)
+        assert isinstance(issues, list)
         # В тестовом окружении могут быть проблемы с FFmpeg - это нормально
 
+    def test_runtime_cache(self, monkeypatch):
+        """Кеш отдает копии, clear_runtime_cache заново проверяет бинарники"""
+        clear_runtime_cache()
+        get_runtime_info()["ffmpeg"]["path"] = "mutated"
+        assert get_runtime_info()["ffmpeg"]["path"] == defaults.FFMPEG
+
+        monkeypatch.setattr("shutil.which", lambda path: None)
+        clear_runtime_cache()
+        try:
+            assert get_runtime_info()["ffmpeg"]["available"] is False
+            assert any("FFmpeg not found" in issue for issue in validate_settings())
+        finally:
+            # Результат подмененного which не должен пережить тест
+            clear_runtime_cache()
+
 
 # Интеграционные smoke тесты
-class TestSystemIntegration(TestCase):
+class TestSystemIntegration:
     """Тесты системной интеграции"""
 
-    def test_django_checks_pass(self):
+    def test_django_checks_pass(self, checks_ran):
         """Django system checks проходят"""
-        from django.core.management import call_command
-        from io import StringIO
-
-        # Запускаем системные проверки
-        out = StringIO()
-        try:
-            call_command('check', stdout=out, stderr=out, verbosity=0)
-            # Если команда выполнилась без исключений, все в порядке
-            self.assertTrue(True)
-        except Exception as e:
-            # В smoke тестах некоторые ошибки могут быть ожидаемыми
-            # (например, отсутствие FFmpeg)
-            if "FFmpeg" not in str(e):
-                raise
+        # Сами проверки выполняются один раз на сессию в фикстуре checks_ran.
+        # Если фикстура отработала без исключений, все в порядке
+        assert checks_ran
 
     def test_app_ready_state(self):
         """Приложение корректно инициализировано"""
-        from django.apps import apps
-
         app_config = apps.get_app_config('hlsfield')
 
         # Приложение должно быть готово
-        self.assertTrue(apps.ready)
-        self.assertIsNotNone(app_config)
+        assert apps.ready
+        assert app_config is not None
 
     def test_urls_importable(self):
         """URL конфигурация импортируется"""
-        try:
-            from hlsfield import urls
-            self.assertTrue(hasattr(urls, 'urlpatterns'))
-        except ImportError:
-            # URLs могут быть опциональными
-            pass
+        # Проверяем наличие модуля без его выполнения: импорт urls
+        # тянет за собой все views
+        spec = importlib.util.find_spec('hlsfield.urls')
+        assert spec is not None
 
 
 # Маркеры для разных типов тестов
 @pytest.mark.unit
-class TestUnitSmoke(TestCase):
+class TestUnitSmoke:
     """Unit smoke тесты"""
 
     def test_basic_functionality(self):
         """Основная функциональность работает"""
-        from hlsfield import VideoField, validate_ladder
-
         # Создание поля
         field = VideoField()
-        self.assertIsNotNone(field)
+        assert field is not None
 
         # Валидация данных
         ladder = [{"height": 720, "v_bitrate": 2500, "a_bitrate": 128}]
-        self.assertTrue(validate_ladder(ladder))
+        assert validate_ladder(ladder)
 
 
 @pytest.mark.integration
-class TestIntegrationSmoke(TestCase):
+class TestIntegrationSmoke:
     """Integration smoke тесты"""
 
-    def test_full_pipeline_mock(self):
+    def test_full_pipeline_mock(self, _no_ffmpeg):
         """Полный pipeline с мокированием"""
-        from unittest.mock import patch, Mock
-        from hlsfield import HLSVideoField
-
-        with patch('hlsfield.utils.run') as mock_run:
-            # Настраиваем мок для успешного выполнения
-            mock_run.return_value.returncode = 0
-            mock_run.return_value.stdout = '{"streams":[], "format":{}}'
-
-            # Создаем поле
-            field = HLSVideoField()
-            self.assertIsNotNone(field)
-
-            # Проверяем что мок настроен
-            self.assertTrue(mock_run)
-
-
-if __name__ == '__main__':
-    import unittest
+        # hlsfield.utils.run подменен на всю сессию фикстурой _no_ffmpeg
+        assert utils.run is _no_ffmpeg
+        assert utils.run([]).returncode == 0
 
-    unittest.main()
+        # Создаем поле
+        field = HLSVideoField()
+        assert field is not None
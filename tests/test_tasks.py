@@ -0,0 +1,481 @@
+"""
+Тесты задач обработки видео (hlsfield.tasks)
+
+FFmpeg и storage не используются: утилиты транскодинга подменяются
+фикстурой task_patches, а граф модель/экземпляр/поле/файл собирается
+заново для каждого теста фикстурой video_mocks из conftest.py.
+
+Общего изменяемого состояния между тестами нет, поэтому pytest-xdist
+распределяет их свободно: pytest -n auto tests/test_tasks.py
+"""
+
+from contextlib import ExitStack, nullcontext
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import DEFAULT, Mock, patch
+
+import pytest
+
+from hlsfield import tasks as _tasks, utils as _utils
+from hlsfield.exceptions import StorageError, TranscodingError
+from hlsfield.views import VideoEvent
+
+# Модули разрешаются один раз: подмены ставятся прямо на эти объекты
+_apps = _tasks.apps
+
+
+MODEL_LABEL = 'tests.Video'
+
+# Фиксированное "сейчас" для подмененного time.time
+FROZEN_NOW = 1_700_000_000.0
+
+# Утилиты, вызовы которых проверяются в тестах
+_UTILS_MOCKS = (
+    'save_tree_to_storage',
+    'transcode_hls_variants',
+    'transcode_dash_variants',
+    'transcode_adaptive_variants',
+)
+
+
+class _Retry(Exception):
+    """Исключение, которое выбрасывает подмененный self.retry"""
+
+
+class _Counter:
+    """Заглушка метода: считает вызовы и помнит последние kwargs"""
+    __slots__ = ("n", "kwargs")
+
+    def __init__(self):
+        self.n = 0
+        self.kwargs = None
+
+    def __call__(self, *args, **kwargs):
+        self.n += 1
+        self.kwargs = kwargs
+
+
+@pytest.fixture(scope='session')
+def prebuilt_tree(tmp_path_factory):
+    """Выходное дерево транскодинга, создается один раз на сессию"""
+    root = tmp_path_factory.mktemp('adaptive_out')
+    (root / 'hls').mkdir()
+    (root / 'dash').mkdir()
+
+    hls_master = root / 'hls' / 'master.m3u8'
+    dash_manifest = root / 'dash' / 'manifest.mpd'
+    hls_master.write_text('#EXTM3U\n')
+    dash_manifest.write_text('<MPD/>')
+
+    return SimpleNamespace(
+        root=root,
+        hls_master=hls_master,
+        dash_manifest=dash_manifest,
+        # Результат transcode_adaptive_variants
+        adaptive={'hls_master': hls_master, 'dash_manifest': dash_manifest},
+    )
+
+
+@pytest.fixture(autouse=True)
+def freeze_clock(monkeypatch):
+    """Замораживает time.time и отключает time.sleep в задачах"""
+    monkeypatch.setattr(_tasks.time, 'sleep', lambda *_: None)
+    monkeypatch.setattr(_tasks.time, 'time', lambda: FROZEN_NOW)
+
+
+@pytest.fixture(autouse=True)
+def task_patches(monkeypatch, video_mocks, prebuilt_tree):
+    """Подменяет ORM и утилиты прямым setattr и отдает словарь Mock-утилит"""
+    # Все задачи работают в одном заранее созданном дереве: mkdir(exist_ok=True)
+    # в задачах идемпотентен, а дерево живет в отдельном basetemp xdist воркера
+    temp_dir = prebuilt_tree.root
+
+    mocks = {name: Mock() for name in _UTILS_MOCKS}
+    for name, mock in mocks.items():
+        monkeypatch.setattr(_utils, name, mock)
+
+    monkeypatch.setattr(_utils, 'tempdir', lambda *a, **k: nullcontext(temp_dir))
+    monkeypatch.setattr(_utils, 'pull_to_local', lambda *a, **k: temp_dir / 'input.mp4')
+    monkeypatch.setattr(_apps, 'get_model', lambda *_: video_mocks.mock_model)
+    monkeypatch.setattr(_tasks, '_resolve_field', lambda *a, **k: video_mocks.resolve_tuple)
+    monkeypatch.setattr(_tasks.transaction, 'atomic', lambda *a, **k: nullcontext())
+    return mocks
+
+
+class TestBasicTasks:
+    """Синхронные задачи HLS/DASH/Adaptive"""
+
+    @pytest.mark.parametrize('task_name,transcode_attr,output,expected_result,expected_instance', [
+        pytest.param(
+            'build_hls_for_field_sync', 'transcode_hls_variants', 'hls_master',
+            {'master_playlist': 'videos/test_video/hls/master.m3u8', 'variants': 2},
+            {'hls_master': 'videos/test_video/hls/master.m3u8', 'processing_status': 'hls_ready'},
+            id='hls',
+        ),
+        pytest.param(
+            'build_dash_for_field_sync', 'transcode_dash_variants', 'dash_manifest',
+            {'manifest': 'videos/test_video/dash/manifest.mpd', 'representations': 2},
+            {'dash_manifest': 'videos/test_video/dash/manifest.mpd', 'processing_status': 'dash_ready'},
+            id='dash',
+        ),
+        pytest.param(
+            'build_adaptive_for_field_sync', 'transcode_adaptive_variants', 'adaptive',
+            {
+                'hls_master': 'videos/test_video/adaptive/hls/master.m3u8',
+                'dash_manifest': 'videos/test_video/adaptive/dash/manifest.mpd',
+                'variants': 2,
+            },
+            {
+                'hls_master': 'videos/test_video/adaptive/hls/master.m3u8',
+                'dash_manifest': 'videos/test_video/adaptive/dash/manifest.mpd',
+                'processing_status': 'adaptive_ready',
+            },
+            id='adaptive',
+            marks=pytest.mark.slow,
+        ),
+    ])
+    def test_build_for_field_sync(
+        self, task_patches, video_mocks, prebuilt_tree,
+        task_name, transcode_attr, output, expected_result, expected_instance,
+    ):
+        """Задача транскодирует, загружает дерево и обновляет модель"""
+        task_patches[transcode_attr].return_value = getattr(prebuilt_tree, output)
+
+        result = getattr(_tasks, task_name)(MODEL_LABEL, 1, 'video')
+
+        assert result['status'] == 'success'
+        assert result.items() >= expected_result.items()
+        # Часы заморожены freeze_clock
+        assert result['transcoding_time'] == 0
+        task_patches['save_tree_to_storage'].assert_called_once()
+        for attr, value in expected_instance.items():
+            assert getattr(video_mocks.mock_instance, attr) == value
+
+    def test_build_hls_error_updates_status(self, task_patches, video_mocks):
+        """Ошибка транскодинга пробрасывается и записывается в статус"""
+        task_patches['transcode_hls_variants'].side_effect = TranscodingError("boom")
+
+        with pytest.raises(TranscodingError):
+            _tasks.build_hls_for_field_sync(MODEL_LABEL, 1, 'video')
+
+        assert video_mocks.mock_instance.processing_status == 'error_HLS'
+
+
+@pytest.mark.slow
+class TestProgressiveTasks:
+    """Прогрессивная обработка"""
+
+    def test_build_progressive_for_field_sync(self, task_patches, prebuilt_tree):
+        """Превью создается первым, затем добавляются остальные качества"""
+        task_patches['transcode_adaptive_variants'].return_value = prebuilt_tree.adaptive
+        options = {'preview_first': True, 'progressive_delay': 0, 'priority_heights': [360]}
+
+        result = _tasks.build_progressive_for_field_sync(MODEL_LABEL, 1, 'video', options)
+
+        assert result == {'status': 'success', 'total_qualities': 2}
+
+        calls = task_patches['transcode_adaptive_variants'].call_args_list
+        assert [len(c.kwargs['ladder']) for c in calls] == [1, 2]
+
+    def test_progressive_priority_order(self, task_patches, prebuilt_tree):
+        """Приоритетные качества идут в лестнице первыми"""
+        task_patches['transcode_adaptive_variants'].return_value = prebuilt_tree.adaptive
+        # Задержка по умолчанию (60s) не ждет: time.sleep отключен freeze_clock
+        options = {'preview_first': False, 'priority_heights': [720]}
+
+        _tasks.build_progressive_for_field_sync(MODEL_LABEL, 1, 'video', options)
+
+        last_ladder = task_patches['transcode_adaptive_variants'].call_args.kwargs['ladder']
+        assert [rung['height'] for rung in last_ladder] == [720, 360]
+
+
+@pytest.fixture(scope='session')
+def celery_config():
+    """Настройки Celery: задачи выполняются синхронно в процессе теста"""
+    return {
+        'broker_url': 'memory://',
+        'result_backend': 'cache+memory://',
+        'task_always_eager': True,
+        'task_eager_propagates': True,
+    }
+
+
+@pytest.fixture(scope='session')
+def celery_app(celery_config):
+    """Текущее приложение Celery в eager режиме, одно на сессию
+
+    Исходные настройки приложения возвращаются в конце сессии.
+    """
+    celery = pytest.importorskip('celery')
+    app = celery.current_app
+    previous = {key: app.conf.get(key) for key in celery_config}
+    app.conf.update(celery_config)
+    yield app
+    app.conf.update(previous)
+
+
+@pytest.mark.usefixtures('celery_app')
+class TestAsyncTasks:
+    """Обертки bind=True через apply(): реальные self.request и self.retry"""
+
+    def test_success_returns_sync_result(self, monkeypatch):
+        """Успешный результат синхронной версии возвращается как есть"""
+        monkeypatch.setattr(
+            _tasks, 'build_hls_for_field_sync', lambda *a, **k: {'status': 'success'}
+        )
+
+        result = _tasks.build_hls_for_field.apply(args=(MODEL_LABEL, 1, 'video'))
+
+        assert result.successful()
+        assert result.get() == {'status': 'success'}
+
+    def test_retry_on_storage_error(self, monkeypatch, video_mocks):
+        """Временная ошибка повторяется до max_retries, затем пишется в статус"""
+        mock_sync = Mock(side_effect=StorageError("storage down"))
+        monkeypatch.setattr(_tasks, 'build_dash_for_field_sync', mock_sync)
+
+        with pytest.raises(StorageError):
+            _tasks.build_dash_for_field.apply(args=(MODEL_LABEL, 1, 'video'))
+
+        # В eager режиме повторы выполняются сразу, без countdown
+        assert mock_sync.call_count == _tasks.build_dash_for_field.max_retries + 1
+        assert video_mocks.mock_instance.processing_status == 'error_DASH'
+
+    def test_non_retryable_error_fails_immediately(self, monkeypatch, video_mocks):
+        """Прочие ошибки не повторяются"""
+        mock_sync = Mock(side_effect=ValueError("bad input"))
+        monkeypatch.setattr(_tasks, 'build_adaptive_for_field_sync', mock_sync)
+
+        with pytest.raises(ValueError):
+            _tasks.build_adaptive_for_field.apply(args=(MODEL_LABEL, 1, 'video'))
+
+        assert mock_sync.call_count == 1
+        assert video_mocks.mock_instance.processing_status == 'error_Adaptive'
+
+
+@pytest.mark.skipif(_tasks.CELERY_AVAILABLE, reason="с Celery задачи проверяет TestAsyncTasks")
+class TestAsyncTasksWithoutCelery:
+    """Обертки bind=True без Celery: self подставляется вручную"""
+
+    def _mock_self(self, retries):
+        mock_self = Mock()
+        mock_self.request.retries = retries
+        mock_self.max_retries = 3
+        mock_self.retry = Mock(side_effect=_Retry)
+        return mock_self
+
+    def test_success_returns_sync_result(self, monkeypatch):
+        """Успешный результат синхронной версии возвращается как есть"""
+        monkeypatch.setattr(
+            _tasks, 'build_hls_for_field_sync', lambda *a, **k: {'status': 'success'}
+        )
+
+        result = _tasks.build_hls_for_field(self._mock_self(0), MODEL_LABEL, 1, 'video')
+
+        assert result == {'status': 'success'}
+
+    def test_retry_on_transcoding_error(self, monkeypatch):
+        """Временная ошибка приводит к повтору с нарастающей задержкой"""
+        mock_self = self._mock_self(1)
+        monkeypatch.setattr(
+            _tasks, 'build_dash_for_field_sync', Mock(side_effect=StorageError("storage down"))
+        )
+
+        with pytest.raises(_Retry):
+            _tasks.build_dash_for_field(mock_self, MODEL_LABEL, 1, 'video')
+
+        mock_self.retry.assert_called_once_with(countdown=120)
+
+    def test_final_failure_marks_error(self, monkeypatch, video_mocks):
+        """После исчерпания повторов ошибка записывается в экземпляр"""
+        mock_self = self._mock_self(3)
+        monkeypatch.setattr(
+            _tasks, 'build_adaptive_for_field_sync', Mock(side_effect=TranscodingError("boom"))
+        )
+
+        with pytest.raises(TranscodingError):
+            _tasks.build_adaptive_for_field(mock_self, MODEL_LABEL, 1, 'video')
+
+        mock_self.retry.assert_not_called()
+        assert video_mocks.mock_instance.processing_status == 'error_Adaptive'
+
+
+class TestTaskHelpers:
+    """Вспомогательные функции модуля задач"""
+
+    @pytest.mark.parametrize("name,suffix,expected", [
+        ("path/to/video.mp4", "hls", "path/to/video/hls/"),
+        ("video_without_ext", "dash", "video_without_ext/dash/"),
+        ("a.b.c", "hls", "a.b/hls/"),  # Отрезается только последнее расширение
+    ])
+    def test_get_base_key(self, name, suffix, expected):
+        """Базовый ключ строится без расширения исходника"""
+        assert _tasks._get_base_key(name, suffix) == expected
+
+    def test_update_instance_status(self, monkeypatch, video_mocks):
+        """Статус и дополнительные поля сохраняются одним save()"""
+        mock_instance = video_mocks.mock_instance
+        monkeypatch.setattr(mock_instance, "save", _Counter())
+
+        _tasks._update_instance_status(mock_instance, "hls_ready", transcoding_time=5)
+
+        assert mock_instance.save.n == 1
+        assert mock_instance.save.kwargs == {
+            "update_fields": ["processing_status", "transcoding_time"]
+        }
+        assert mock_instance.processing_status == "hls_ready"
+
+    def test_update_instance_status_swallows_errors(self, monkeypatch, video_mocks):
+        """Ошибка сохранения не прерывает задачу"""
+        mock_instance = video_mocks.mock_instance
+        monkeypatch.setattr(mock_instance, "save", Mock(side_effect=Exception("db down")))
+
+        _tasks._update_instance_status(mock_instance, "hls_ready")
+
+        mock_instance.save.assert_called_once()
+
+    def test_adjust_ladder_for_size_limit(self, sample_ladder):
+        """Битрейты уменьшаются пропорционально лимиту размера"""
+        adjusted = _tasks._adjust_ladder_for_size_limit(sample_ladder, {"duration": 600}, 100)
+
+        assert len(adjusted) == len(sample_ladder)
+        for original, rung in zip(sample_ladder, adjusted):
+            assert rung["v_bitrate"] <= original["v_bitrate"]
+            assert rung["v_bitrate"] >= 200
+            assert rung["a_bitrate"] >= 64
+
+    def test_adjust_ladder_without_duration(self, sample_ladder):
+        """Без длительности лестница не меняется"""
+        assert _tasks._adjust_ladder_for_size_limit(sample_ladder, {}, 1) is sample_ladder
+
+
+class TestMaintenanceTasks:
+    """Batch операции, обслуживание и аналитика"""
+
+    def test_batch_optimize_with_errors(self, monkeypatch, video_mocks):
+        """Ошибки отдельных видео не прерывают batch"""
+        mock_model = Mock()
+
+        def mock_get(pk):
+            if pk == 2:
+                raise Exception("not found")
+            return video_mocks.mock_instance
+
+        mock_model.objects.get.side_effect = mock_get
+        monkeypatch.setattr(_apps, 'get_model', lambda *_: mock_model)
+
+        with patch('hlsfield.tasks.optimize_existing_video') as mock_optimize:
+            mock_optimize.delay.return_value = SimpleNamespace(id='task-1')
+
+            result = _tasks.batch_optimize_videos(MODEL_LABEL, [1, 2], 'video')
+
+        assert result['total_processed'] == 2
+        assert result['successful'] == 1
+        assert result['failed'] == 1
+
+        by_pk = {r['pk']: r for r in result['results']}
+        assert by_pk[1]['status'] == 'queued'
+        assert by_pk[1]['task_id'] == 'task-1'
+        assert by_pk[2]['status'] == 'error'
+
+    def test_optimize_existing_video(self):
+        """Оптимизация строит лестницу под разрешение исходника"""
+        with ExitStack() as stack:
+            analyze = stack.enter_context(patch('hlsfield.utils.analyze_video_complexity'))
+            probe = stack.enter_context(patch('hlsfield.utils.ffprobe_streams'))
+            pick = stack.enter_context(patch('hlsfield.utils.pick_video_audio_streams'))
+            build = stack.enter_context(patch('hlsfield.tasks._build_single_quality'))
+
+            analyze.return_value = {'duration': 60}
+            probe.return_value = {'streams': []}
+            pick.return_value = ({'width': 1280, 'height': 720}, None)
+
+            result = _tasks.optimize_existing_video(MODEL_LABEL, 1, 'video', target_qualities=3)
+
+        assert result['status'] == 'success'
+        assert 0 < result['optimized_qualities'] <= 3
+        build.assert_called_once()
+        probe.assert_called_once()
+        assert analyze.call_args.kwargs['streams'] is probe.return_value
+
+    def test_health_check_videos(self, monkeypatch, video_mocks):
+        """Отсутствующие исходники и манифесты попадают в отчет"""
+        healthy = SimpleNamespace(pk=1, hls_master='path/to/master.m3u8', dash_manifest=None)
+        broken = SimpleNamespace(pk=2, hls_master='path/to/missing_master.m3u8', dash_manifest=None)
+
+        mock_model = Mock()
+        mock_model.objects.all.return_value = [healthy, broken]
+
+        # Точные пути вместо поиска подстрок: KeyError сразу покажет лишний запрос
+        exists_map = {
+            'healthy.mp4': True,
+            'broken.mp4': False,
+            'path/to/master.m3u8': True,
+            'path/to/missing_master.m3u8': False,
+        }
+        mock_storage = Mock()
+        mock_storage.exists.side_effect = exists_map.__getitem__
+
+        resolve_map = {
+            1: (video_mocks.mock_field, SimpleNamespace(), mock_storage, 'healthy.mp4'),
+            2: (video_mocks.mock_field, SimpleNamespace(), mock_storage, 'broken.mp4'),
+        }
+
+        monkeypatch.setattr(_apps, 'get_model', lambda *_: mock_model)
+        monkeypatch.setattr(_tasks, '_resolve_field', lambda inst, _: resolve_map[inst.pk])
+
+        result = _tasks.health_check_videos(MODEL_LABEL, 'video')
+
+        assert result['total_checked'] == 2
+        assert result['issues_found'] == 1
+        assert result['healthy_videos'] == 1
+        assert result['issues'][0]['pk'] == 2
+        assert result['issues'][0]['problems'] == ["Original file missing", "HLS manifest missing"]
+
+    def test_cleanup_old_temp_files(self):
+        """Файлы старше суток удаляются"""
+        old_time = FROZEN_NOW - 90000
+
+        # Один patch.multiple вместо трех вложенных patch.object
+        with patch('glob.glob', return_value=['/tmp/hls_old']), patch.multiple(
+            Path,
+            stat=Mock(return_value=SimpleNamespace(st_mtime=old_time)),
+            is_dir=Mock(return_value=False),
+            unlink=DEFAULT,
+        ) as path_mocks:
+            result = _tasks.cleanup_old_temp_files()
+
+        # По одному файлу на каждый из четырех шаблонов
+        assert result == {'cleaned': 4, 'errors': 0}
+        assert path_mocks['unlink'].call_count == 4
+
+    @pytest.mark.django_db(transaction=False)
+    def test_generate_video_analytics_report(self):
+        """Отчет собирается реальными запросами к VideoEvent"""
+        VideoEvent.objects.bulk_create([
+            VideoEvent(video_id='v1', session_id='s1', event_type='play', quality='720p'),
+            VideoEvent(video_id='v1', session_id='s2', event_type='play', quality='720p'),
+            VideoEvent(video_id='v2', session_id='s1', event_type='play', quality='360p'),
+            VideoEvent(video_id='v1', session_id='s1', event_type='ended', quality='720p'),
+            VideoEvent(video_id='v2', session_id='s1', event_type='error'),
+            VideoEvent(video_id='v2', session_id='s1', event_type='buffer_start'),
+        ])
+
+        report = _tasks.generate_video_analytics_report(days=7)
+
+        assert report['period'] == 'Last 7 days'
+        assert report['total_events'] == 6
+        assert report['unique_videos'] == 2
+        assert report['unique_sessions'] == 2
+        assert report['play_events'] == 3
+        assert report['completion_events'] == 1
+        assert report['error_events'] == 1
+        assert report['buffer_events'] == 1
+        assert report['top_videos'] == [
+            {'video_id': 'v1', 'views': 2},
+            {'video_id': 'v2', 'views': 1},
+        ]
+        assert report['quality_distribution'] == [
+            {'quality': '720p', 'count': 3},
+            {'quality': '360p', 'count': 1},
+        ]
@@ -0,0 +1,444 @@
+"""
+Тесты транскодирования HLS/DASH в hlsfield.utils
+"""
+import asyncio
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import pytest
+
+from hlsfield import utils
+from hlsfield.exceptions import TranscodingError
+
+# Настоящие функции - фикстуры (probe, ffmpeg_stub, _no_ffmpeg) подменяют атрибуты модуля
+_ffprobe_streams = utils.ffprobe_streams
+_real_run = utils.run
+
+# Один общий результат "успешного" запуска: side_effect вызывается на каждую
+# команду, и новый Mock на каждый вызов заметно дороже
+_OK = utils.RunResult(0, "", "")
+
+_PROBE = {
+    "streams": [
+        {"codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080},
+        {"codec_type": "audio", "codec_name": "aac"},
+    ],
+    "format": {"duration": "60.0"},
+}
+
+
+def _ok(cmd, *args, **kwargs):
+    return _OK
+
+
+def _fake_hls_encode(cmd, *args, **kwargs):
+    """Эмулирует FFmpeg: создает плейлист и один сегмент для варианта
+
+    Директорию варианта уже создал построитель команды - mkdir в заглушках
+    не нужен (это был бы лишний syscall на каждый запуск).
+    """
+    playlist = Path(cmd[-1])
+    playlist.write_text("#EXTM3U\n")
+    (playlist.parent / "seg_0000.ts").write_bytes(b"\x47")
+    return _OK
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "input.mp4"
+    path.write_bytes(b"\x00" * 16)
+    return path
+
+
+@pytest.fixture(autouse=True)
+def probe(monkeypatch):
+    monkeypatch.setattr(utils, "ffprobe_streams", lambda input_path: _PROBE)
+
+
+@pytest.fixture
+def ffmpeg_stub(monkeypatch):
+    """Подменяет utils.run: команды копятся в .calls, поведение задает .side_effect"""
+    stub = SimpleNamespace(calls=[], side_effect=_ok)
+
+    def _run(cmd, *args, **kwargs):
+        stub.calls.append(cmd)
+        return stub.side_effect(cmd, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "run", _run)
+    return stub
+
+
+class TestHLSTranscoding:
+
+    def test_hls_transcoding_success(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        ffmpeg_stub.side_effect = _fake_hls_encode
+        out_dir = tmp_path / "hls"
+
+        master = utils.transcode_hls_variants(input_file, out_dir, sample_ladder)
+
+        assert master == out_dir / "master.m3u8"
+        assert len(ffmpeg_stub.calls) == len(sample_ladder)
+        for rung in sample_ladder:
+            assert (out_dir / f"v{rung['height']}").exists()
+
+        # Варианты завершаются в произвольном порядке, master все равно по возрастанию
+        content = master.read_text()
+        positions = [content.index(f"v{rung['height']}/index.m3u8") for rung in sample_ladder]
+        assert positions == sorted(positions)
+
+    def test_hls_partial_failure(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        def selective_failure(cmd, *args, **kwargs):
+            if "v720" in cmd[-1]:
+                raise TranscodingError("encoder crashed")
+            return _fake_hls_encode(cmd)
+
+        ffmpeg_stub.side_effect = selective_failure
+
+        master = utils.transcode_hls_variants(input_file, tmp_path / "hls", sample_ladder)
+
+        content = master.read_text()
+        assert "v360/index.m3u8" in content
+        assert "v720/index.m3u8" not in content
+        assert len(ffmpeg_stub.calls) == len(sample_ladder)
+
+    def test_hls_all_variants_fail(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        def crash(cmd, *args, **kwargs):
+            raise TranscodingError("boom")
+
+        ffmpeg_stub.side_effect = crash
+
+        with pytest.raises(TranscodingError, match="No HLS variants"):
+            utils.transcode_hls_variants(input_file, tmp_path / "hls", sample_ladder)
+
+    def test_max_parallel_limits_workers(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        ffmpeg_stub.side_effect = _fake_hls_encode
+
+        with patch("hlsfield.utils.ThreadPoolExecutor", wraps=ThreadPoolExecutor) as pool:
+            utils.transcode_hls_variants(input_file, tmp_path / "hls", sample_ladder, max_parallel=1)
+
+        assert pool.call_args.kwargs["max_workers"] == 1
+        # Один воркер - порядок вызовов равен порядку очереди: старшие качества первыми
+        heights = [int(cmd[-1].split("/v")[-1].split("/")[0]) for cmd in ffmpeg_stub.calls]
+        assert heights == sorted((rung["height"] for rung in sample_ladder), reverse=True)
+
+    def test_threads_capped_per_rung(self, ffmpeg_stub, input_file, tmp_path, sample_ladder, monkeypatch):
+        monkeypatch.setattr("hlsfield.defaults.FFMPEG_THREADS", 4)
+        ffmpeg_stub.side_effect = _fake_hls_encode
+
+        utils.transcode_hls_variants(input_file, tmp_path / "hls", sample_ladder)
+
+        # Опция вывода - перед плейлистом варианта
+        assert all(cmd[-3:-1] == ["-threads", "4"] for cmd in ffmpeg_stub.calls)
+
+    def test_hls_single_pass(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        out_dir = tmp_path / "hls"
+
+        def fused_encode(cmd, *args, **kwargs):
+            for rung in sample_ladder:
+                variant_dir = out_dir / f"v{rung['height']}"
+                (variant_dir / "index.m3u8").write_text("#EXTM3U\n")
+                (variant_dir / "seg_0000.ts").write_bytes(b"\x47")
+            (out_dir / "master.m3u8").write_text("#EXTM3U\n")
+            return _OK
+
+        ffmpeg_stub.side_effect = fused_encode
+
+        master = utils.transcode_hls_variants(input_file, out_dir, sample_ladder, single_pass=True)
+
+        assert master == out_dir / "master.m3u8"
+        assert len(ffmpeg_stub.calls) == 1
+        cmd = ffmpeg_stub.calls[0]
+        assert cmd.count("-i") == 1
+        assert "-master_pl_name" in cmd
+        # Один процесс на всю лестницу - потоки не ограничиваются
+        assert "-threads" not in cmd
+        assert cmd[cmd.index("-var_stream_map") + 1] == (
+            "v:0,a:0,name:360 v:1,a:1,name:720 v:2,a:2,name:1080"
+        )
+
+    def test_hls_remote_upload(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        out_dir = tmp_path / "hls"
+
+        master = utils.transcode_hls_variants(
+            input_file, out_dir, sample_ladder, remote_url="https://storage.example/video/1/"
+        )
+
+        cmd = next(c for c in ffmpeg_stub.calls if "v720" in c[-1])
+        assert cmd[-1] == "https://storage.example/video/1/v720/index.m3u8"
+        assert cmd[cmd.index("-method") + 1] == "PUT"
+        # Сегментов локально нет, а master пишется локально для отдельной загрузки
+        assert "v720/index.m3u8" in master.read_text()
+
+    def test_async_hls_transcoding(self, monkeypatch, input_file, tmp_path, sample_ladder):
+        calls = []
+
+        async def fake_arun(cmd, timeout_sec=600):
+            calls.append(cmd)
+            if "v720" in cmd[-1]:
+                raise TranscodingError("encoder crashed")
+            _fake_hls_encode(cmd)
+
+        monkeypatch.setattr(utils, "_arun", fake_arun)
+
+        master = asyncio.run(utils.atranscode_hls_variants(input_file, tmp_path / "hls", sample_ladder))
+
+        content = master.read_text()
+        assert "v360/index.m3u8" in content
+        assert "v720/index.m3u8" not in content
+        assert len(calls) == len(sample_ladder)
+
+    def test_async_pipeline(self, monkeypatch, input_file, tmp_path, sample_ladder):
+        async def fake_arun(cmd, timeout_sec=600):
+            _fake_hls_encode(cmd)
+
+        def fake_preview(input_path, out_image, at_sec=3.0):
+            out_image.write_bytes(b"\xff" * 200)
+            return out_image
+
+        monkeypatch.setattr(utils, "_arun", fake_arun)
+        monkeypatch.setattr(utils, "extract_preview", fake_preview)
+        storage = Mock()
+        storage.save.side_effect = lambda key, fh: key
+
+        result = asyncio.run(utils.process_video_async(input_file, storage, "videos/1/hls/", sample_ladder))
+
+        assert result["hls_master"] == "videos/1/hls/master.m3u8"
+        assert result["preview"] == "videos/1/hls/preview.jpg"
+        assert "videos/1/hls/master.m3u8" in result["files"]
+        assert "videos/1/hls/v360/index.m3u8" in result["files"]
+
+    def test_async_pipeline_survives_preview_failure(self, monkeypatch, input_file, sample_ladder):
+        async def fake_arun(cmd, timeout_sec=600):
+            _fake_hls_encode(cmd)
+
+        monkeypatch.setattr(utils, "_arun", fake_arun)
+        monkeypatch.setattr(utils, "extract_preview", Mock(side_effect=TranscodingError("no frame")))
+        storage = Mock()
+        storage.save.side_effect = lambda key, fh: key
+
+        result = asyncio.run(utils.process_video_async(input_file, storage, "videos/1/hls", sample_ladder))
+
+        assert result["preview"] is None
+        assert "videos/1/hls/preview.jpg" not in result["files"]
+
+    def test_arun_takes_ffmpeg_slot(self, monkeypatch):
+        slots = MagicMock()
+        proc = SimpleNamespace(returncode=0, communicate=AsyncMock(return_value=(b"", b"")))
+        spawn = AsyncMock(return_value=proc)
+        monkeypatch.setattr(utils, "_ffmpeg_slots", slots)
+        monkeypatch.setattr(utils, "ensure_binary_available", lambda name, path: path)
+        monkeypatch.setattr(utils.asyncio, "create_subprocess_exec", spawn)
+
+        asyncio.run(utils._arun(["ffmpeg", "-i", "in.mp4", "out.m3u8"]))
+
+        spawn.assert_awaited_once()
+        assert slots.__enter__.call_count == slots.__exit__.call_count == 1
+
+        # Та же проверка команды, что у run(): до запуска и без слота
+        with pytest.raises(utils.SecurityError):
+            asyncio.run(utils._arun(["ffmpeg", "-i", "in.mp4", "out.m3u8; rm -rf /"]))
+        spawn.assert_awaited_once()
+        assert slots.__enter__.call_count == 1
+
+    @patch("hlsfield.utils.ensure_binary_available", side_effect=lambda name, path: path)
+    @patch("hlsfield.utils.subprocess.run")
+    def test_run_accepts_filter_graph(self, mock_subprocess, mock_ensure, sample_ladder):
+        mock_subprocess.return_value = _OK
+        graph = utils._build_hls_filter_complex(sample_ladder)
+
+        _real_run(["ffmpeg", "-i", "in.mp4", "-filter_complex", graph, "out.m3u8"])
+
+        cmd = mock_subprocess.call_args.args[0]
+        assert cmd[cmd.index("-filter_complex") + 1] == graph
+
+
+class TestAdaptiveTranscoding:
+
+    @staticmethod
+    def _fake_encode(cmd, *args, **kwargs):
+        target = Path(cmd[-1])
+        if target.suffix == ".mpd":
+            target.write_text("<MPD/>")
+            (target.parent / "chunk_0_00001.m4s").write_bytes(b"\x00")
+            return _OK
+        return _fake_hls_encode(cmd)
+
+    def test_adaptive_transcoding(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        ffmpeg_stub.side_effect = self._fake_encode
+
+        result = utils.transcode_adaptive_variants(input_file, tmp_path / "out", sample_ladder)
+
+        assert result["hls_master"] == tmp_path / "out" / "hls" / "master.m3u8"
+        assert result["dash_manifest"] == tmp_path / "out" / "dash" / "manifest.mpd"
+        # len(ladder) HLS запусков + один DASH
+        assert len(ffmpeg_stub.calls) == len(sample_ladder) + 1
+
+    def test_adaptive_hls_failure(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        def hls_fails(cmd, *args, **kwargs):
+            if cmd[-1].endswith(".m3u8"):
+                raise TranscodingError("encoder crashed")
+            return self._fake_encode(cmd)
+
+        ffmpeg_stub.side_effect = hls_fails
+
+        with pytest.raises(TranscodingError, match="No HLS variants"):
+            utils.transcode_adaptive_variants(input_file, tmp_path / "out", sample_ladder)
+
+
+class TestTranscodingHelpers:
+
+    def test_build_hls_filter_complex(self, sample_ladder):
+        graph = utils._build_hls_filter_complex(sample_ladder[:2])
+
+        assert graph.startswith("[0:v]split=2[v0][v1];")
+        assert "[v0]scale=w=-2:h=360" in graph
+        assert graph.endswith("[o1]")
+
+    def test_dash_filter_complex(self, ffmpeg_stub, input_file, tmp_path, sample_ladder):
+        ffmpeg_stub.side_effect = TestAdaptiveTranscoding._fake_encode
+        utils._build_dash_filter_complex.cache_clear()
+
+        for _ in range(2):
+            utils.transcode_dash_variants(input_file, tmp_path / "dash", sample_ladder)
+
+        cmd = ffmpeg_stub.calls[-1]
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        assert graph == (
+            "[0:v]split=3[v0][v1][v2];"
+            "[v0]scale=-2:360[o0];[v1]scale=-2:720[o1];[v2]scale=-2:1080[o2]"
+        )
+        assert "-b:v:2" in cmd
+        # У каждого аудиопотока свой битрейт ступени, а не последний на всех
+        assert [cmd[cmd.index(f"-b:a:{i}") + 1] for i in range(3)] == ["96k", "128k", "160k"]
+        assert "-b:a" not in cmd
+        assert "-threads" not in cmd
+        assert utils._build_dash_filter_complex.cache_info().hits == 1
+
+    def test_dash_zero_audio_rung(self, ffmpeg_stub, input_file, tmp_path):
+        ffmpeg_stub.side_effect = TestAdaptiveTranscoding._fake_encode
+        ladder = [
+            {"height": 360, "v_bitrate": 800, "a_bitrate": 0},
+            {"height": 720, "v_bitrate": 2500, "a_bitrate": 128},
+        ]
+
+        utils.transcode_dash_variants(input_file, tmp_path / "dash", ladder)
+
+        cmd = ffmpeg_stub.calls[-1]
+        # Один выход на все representation: "-an" выключил бы звук у всех
+        assert "-an" not in cmd
+        assert cmd.count("0:a:0") == 1
+        assert cmd[cmd.index("-adaptation_sets") + 1] == "id=0,streams=v id=1,streams=a"
+
+    def test_create_hls_master_playlist(self, tmp_path):
+        variants = [
+            {"height": 720, "bandwidth": 2628000, "resolution": "1280x720",
+             "dir": "v720", "playlist": "index.m3u8"},
+            {"height": 360, "bandwidth": 896000, "resolution": "640x360",
+             "dir": "v360", "playlist": "index.m3u8"},
+        ]
+
+        master = utils._create_master_playlist(tmp_path, variants)
+
+        content = master.read_text()
+        assert content.startswith("#EXTM3U\n")
+        assert "BANDWIDTH=896000" in content
+        assert "RESOLUTION=1280x720" in content
+        assert content.index("v360/") < content.index("v720/")
+
+    def test_master_playlist_sorted_by_bandwidth(self, tmp_path):
+        # Ступень 720p с низким битрейтом должна идти первой
+        variants = [
+            {"height": 360, "bandwidth": 896000, "dir": "v360"},
+            {"height": 720, "bandwidth": 600000, "dir": "v720"},
+        ]
+
+        content = utils._create_master_playlist(tmp_path, variants, gzip_manifests=False).read_text()
+
+        assert content.index("BANDWIDTH=600000") < content.index("BANDWIDTH=896000")
+
+    def test_ffprobe_cached_until_file_changes(self, ffmpeg_stub, input_file, monkeypatch):
+        probe_result = utils.RunResult(0, '{"streams": []}', "")
+        ffmpeg_stub.side_effect = lambda cmd, *args, **kwargs: probe_result
+        monkeypatch.chdir(input_file.parent)
+
+        _ffprobe_streams(input_file)
+        _ffprobe_streams(str(input_file))
+        _ffprobe_streams(input_file.name)
+        assert len(ffmpeg_stub.calls) == 1
+
+        input_file.write_bytes(b"\x00" * 32)
+        _ffprobe_streams(input_file)
+        assert len(ffmpeg_stub.calls) == 2
+
+    @pytest.mark.parametrize("audio_bitrate, codecs", [
+        (128, 'CODECS="avc1.42E01E,mp4a.40.2"'),
+        (0, 'CODECS="avc1.42E01E"'),
+    ])
+    def test_master_playlist_codecs(self, tmp_path, audio_bitrate, codecs):
+        variants = [{"height": 360, "bandwidth": 896000, "resolution": "640x360",
+                     "dir": "v360", "playlist": "index.m3u8", "audio_bitrate": audio_bitrate}]
+
+        master = utils._create_master_playlist(tmp_path, variants, gzip_manifests=False)
+
+        assert codecs in master.read_text()
+        assert [p.name for p in tmp_path.iterdir()] == ["master.m3u8"]
+
+    def test_master_playlist_gzip_copies(self, tmp_path):
+        (tmp_path / "v360").mkdir()
+        (tmp_path / "v360" / "index.m3u8").write_text("#EXTM3U\n")
+        variants = [{"height": 360, "bandwidth": 896000, "resolution": "640x360",
+                     "dir": "v360", "playlist": "index.m3u8"}]
+
+        master = utils._create_master_playlist(tmp_path, variants, gzip_manifests=True)
+
+        assert gzip.decompress((tmp_path / "master.m3u8.gz").read_bytes()) == master.read_bytes()
+        assert gzip.decompress((tmp_path / "v360" / "index.m3u8.gz").read_bytes()) == b"#EXTM3U\n"
+
+    @pytest.mark.parametrize("has_audio, expected", [
+        (True, ("-map", "0:a:0", "-c:a", "aac", "-b:a", "96k", "-ac", "2", "-ar", "48000")),
+        (False, ("-an",)),
+    ])
+    def test_audio_args(self, sample_ladder, has_audio, expected):
+        assert utils._audio_args(sample_ladder[0], has_audio, "aac", 2, 48000) == expected
+
+    def test_hls_variant_round_trip(self):
+        variant = utils.HLSVariant(height=720, width=1280, bandwidth=2628000, dir="v720",
+                                   segments_count=10, audio_bitrate=128)
+
+        assert variant.resolution == "1280x720"
+        assert variant.bandwidth_str == "2628000"
+        assert utils.HLSVariant.from_dict({**variant.to_dict(), "extra": 1}) == variant
+        with pytest.raises(AttributeError):
+            variant.height = 360
+
+    def test_count_segments_per_variant(self, tmp_path):
+        for name, count in (("v360", 3), ("v720", 0)):
+            (tmp_path / name).mkdir()
+            (tmp_path / name / "index.m3u8").write_text("#EXTM3U\n")
+            for i in range(count):
+                (tmp_path / name / f"seg_{i:04d}.ts").write_bytes(b"\x47")
+        (tmp_path / "master.m3u8").write_text("#EXTM3U\n")
+
+        assert utils._count_segments_per_variant(tmp_path) == {"v360": 3, "v720": 0}
+
+    def test_filter_ladder_by_source(self, sample_ladder):
+        filtered = utils._filter_ladder_by_source(sample_ladder, 720)
+        assert [r["height"] for r in filtered] == [360, 720]
+
+    def test_filter_ladder_all_higher(self, sample_ladder):
+        filtered = utils._filter_ladder_by_source(sample_ladder, 144)
+        assert [r["height"] for r in filtered] == [360]
+
+    @pytest.mark.parametrize("source_height, expected", [(1080, [240, 360, 480, 720, 960, 1080]), (100, [240])])
+    def test_filter_long_ladder(self, source_height, expected):
+        # 10 ступеней - путь через numpy, если он установлен
+        heights = [1440, 240, 720, 2160, 480, 1080, 360, 1200, 960, 1800]
+        ladder = [{"height": h, "v_bitrate": h, "a_bitrate": 96} for h in heights]
+
+        filtered = utils._filter_ladder_by_source(ladder, source_height)
+
+        assert [r["height"] for r in filtered] == expected
+        assert all(r in ladder for r in filtered)
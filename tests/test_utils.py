@@ -1,10 +1,24 @@
+"""
+Тесты hlsfield.utils
+
+Модуль безопасен для pytest-xdist: временные файлы живут в корне от
+tmp_path_factory (свой на воркер), процессы и storage подменены. Раздать
+тесты модуля по ядрам - make test-utils.
+"""
+import io
+import os
 import shutil
-import tempfile
-from pathlib import Path
-from unittest.mock import Mock, patch
+import struct
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from subprocess import TimeoutExpired
+from types import MappingProxyType, SimpleNamespace
+from typing import Dict
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
 
 import pytest
-from django.test import TestCase
 
 from hlsfield.exceptions import (
     FFmpegError,
@@ -12,34 +26,205 @@ from hlsfield.exceptions import (
     InvalidVideoError,
     StorageError,
     TimeoutError,
+    TranscodingError,
 )
 from hlsfield.utils import (
+    RunResult,
+    analyze_video_complexity,
+    ffprobe_streams_batch,
     tempdir,
     run,
     pick_video_audio_streams,
     get_video_info_quick,
     extract_preview,
+    extract_previews_multi,
     validate_video_file,
     pull_to_local,
     save_tree_to_storage,
 )
 
 
-class TestUtils(TestCase):
+# Успешный результат subprocess.run: атрибуты без валидации CompletedProcess
+_OK = SimpleNamespace(returncode=0, stdout="", stderr="")
+
+
+def _make_ok(stdout=""):
+    return SimpleNamespace(returncode=0, stdout=stdout, stderr="")
+
+
+# Ответы ffprobe: строка для подмененного run, готовые dict - для подмены
+# ffprobe_streams (тесты их только читают, собирать заново на каждый тест не нужно)
+_PROBE_JSON = '{"format": {"duration": "120.5", "size": "1024000", "bit_rate": "2000000"}}'
+_PROBE_1080P = {
+    "streams": [{"codec_type": "video", "width": 1920, "height": 1080, "codec_name": "h264"}],
+    "format": {"duration": "60.0", "size": "1000000", "bit_rate": "2000000"},
+}
+_PROBE_AUDIO_ONLY = {
+    "streams": [{"codec_type": "audio", "sample_rate": 44100}],
+    "format": {"duration": "120.5", "size": "1048576"},
+}
+
+_MP4_STUB = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom\x00\x00\x00\x01mdat'
+
+
+@pytest.fixture(scope='session')
+def utils_tmp_root(tmp_path_factory):
+    """Один временный корень на сессию (воркер xdist); чистит сам pytest"""
+    return tmp_path_factory.mktemp('utils')
+
+
+@pytest.fixture(scope='session')
+def stub_video(utils_tmp_root):
+    """Минимальный тестовый видеофайл (заглушка) - пишется один раз, только для чтения"""
+    path = utils_tmp_root / 'test_video.mp4'
+    path.write_bytes(_MP4_STUB)
+    return path
+
+
+@pytest.fixture(scope='session')
+def big_mp4_stub(utils_tmp_root):
+    """MP4 нормального размера (1 MB): заголовок ftyp + нули"""
+    path = utils_tmp_root / 'big.mp4'
+    path.write_bytes(_MP4_STUB.ljust(1_000_000, b'\x00'))
+    return path
+
+
+@pytest.fixture(scope='session')
+def file_tree(utils_tmp_root):
+    """Дерево из двух файлов для save_tree_to_storage - строится один раз, только для чтения"""
+    root = utils_tmp_root / 'tree'
+    (root / 'subdir').mkdir(parents=True)
+    (root / 'file1.txt').write_text('content1')
+    (root / 'subdir' / 'file2.txt').write_text('content2')
+    return root
+
 
-    def setUp(self):
-        """Настройка тестовых данных"""
-        self.test_dir = Path(tempfile.mkdtemp())
-        self.test_video = self.test_dir / "test_video.mp4"
+# Неизменяемые общие данные для выбора потоков: создаются один раз на модуль
+_VIDEO_1080 = MappingProxyType({"codec_type": "video", "width": 1920, "height": 1080})
+_VIDEO_720 = MappingProxyType({"codec_type": "video", "width": 1280, "height": 720})
+_AUDIO_44K = MappingProxyType({"codec_type": "audio", "sample_rate": 44100})
+_AUDIO_48K = MappingProxyType({"codec_type": "audio", "sample_rate": 48000})
 
-        # Создаем минимальный тестовый видеофайл (заглушка)
-        with open(self.test_video, 'wb') as f:
-            f.write(b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom\x00\x00\x00\x01mdat')
+_PICK_CASES = [
+    # Берутся первые потоки каждого типа
+    ("video+audio", (_VIDEO_1080, _AUDIO_44K, _VIDEO_720, _AUDIO_48K), _VIDEO_1080, _AUDIO_44K),
+    ("no audio", (_VIDEO_1080,), _VIDEO_1080, None),
+    ("no video", (_AUDIO_44K,), None, _AUDIO_44K),
+    ("empty", (), None, None),
+]
 
-    def tearDown(self):
-        """Очистка после тестов"""
-        if self.test_dir.exists():
-            shutil.rmtree(self.test_dir)
+
+@pytest.mark.parametrize(
+    "streams,exp_video,exp_audio",
+    [case[1:] for case in _PICK_CASES],
+    ids=[case[0] for case in _PICK_CASES],
+)
+def test_pick_streams(streams, exp_video, exp_audio):
+    """Тестируем выбор видео и аудио потоков"""
+    video_stream, audio_stream = pick_video_audio_streams(MappingProxyType({"streams": streams}))
+
+    assert video_stream is exp_video
+    assert audio_stream is exp_audio
+
+
+# (id, имя файла, содержимое или None - файла нет, ожидаемая ошибка)
+_REJECT_CASES = [
+    ("nonexistent", "missing.mp4", None, "File does not exist"),
+    ("empty", "empty.mp4", b"", "File too small"),
+    ("unsupported ext", "clip.xyz", _MP4_STUB.ljust(200, b"\x00"), "Unsupported file extension"),
+]
+
+
+@pytest.mark.parametrize(
+    "name,content,issue",
+    [case[1:] for case in _REJECT_CASES],
+    ids=[case[0] for case in _REJECT_CASES],
+)
+def test_validate_video_file_rejects(tmp_path, name, content, issue):
+    """Несуществующий, пустой файл и файл с чужим расширением отклоняются"""
+    path = tmp_path / name
+    if content is not None:
+        path.write_bytes(content)
+
+    result = validate_video_file(path)
+
+    assert not result["valid"]
+    assert any(text.startswith(issue) for text in result["issues"])
+
+
+# Сценарии ffprobe для get_video_info_quick: (id, поведение подмененного run, ожидаемое)
+_INFO_QUICK_CASES = [
+    ("ok", {"return_value": RunResult(0, _PROBE_JSON, "")},
+     {"duration": 120.5, "size": 1024000, "bitrate": 2000000}),
+    # При ошибке ffprobe - значения по умолчанию
+    ("error", {"side_effect": Exception("FFprobe error")},
+     {"duration": 0, "size": 0, "bitrate": 0, "format_name": "unknown"}),
+]
+
+
+@pytest.mark.parametrize(
+    "run_behaviour,expected",
+    [case[1:] for case in _INFO_QUICK_CASES],
+    ids=[case[0] for case in _INFO_QUICK_CASES],
+)
+def test_get_video_info_quick(monkeypatch, stub_video, run_behaviour, expected):
+    """Тестируем быстрый анализ видео: успешный ответ ffprobe и ошибка"""
+    monkeypatch.setattr("hlsfield.utils.run", Mock(**run_behaviour))
+
+    info = get_video_info_quick(stub_video)
+
+    assert {key: info[key] for key in expected} == expected
+
+
+@dataclass
+class FakeStorage:
+    """In-memory storage: только то, что вызывают утилиты (без Mock)"""
+
+    files: Dict[str, bytes] = field(default_factory=dict)
+
+    def path(self, name):
+        raise NotImplementedError("No local paths")
+
+    def open(self, name, mode="rb"):
+        try:
+            return io.BytesIO(self.files[name])
+        except KeyError:
+            raise FileNotFoundError(name) from None
+
+    def save(self, name, content):
+        self.files[name] = content.read()
+        return name
+
+
+class TestUtils(TestCase):
+
+    @pytest.fixture(autouse=True)
+    def _test_dirs(self, utils_tmp_root, stub_video, big_mp4_stub, file_tree):
+        """Дешевая поддиректория сессионного корня вместо mkdtemp/rmtree на тест
+
+        Файлы-образцы создаются один раз на сессию и только читаются.
+        """
+        self.test_dir = utils_tmp_root / uuid.uuid4().hex
+        self.test_dir.mkdir()
+        self.test_video = stub_video
+        self.big_mp4 = big_mp4_stub
+        self.file_tree = file_tree
+
+    @pytest.fixture(autouse=True)
+    def _stub_processes(self, monkeypatch):
+        """Один набор заглушек процессов на тест вместо @patch на каждом методе
+
+        subprocess_run - под настоящим run(), ffmpeg_run - вместо run() для
+        функций поверх него. Тесты меняют return_value/side_effect, а остальное
+        подменяют через self.monkeypatch (откат - в teardown фикстуры).
+        """
+        self.monkeypatch = monkeypatch
+        self.subprocess_run = Mock(return_value=_OK)
+        self.ffmpeg_run = Mock(return_value=RunResult(0, "", ""))
+        self.ensure_binary = Mock(side_effect=lambda name, path: path)
+        monkeypatch.setattr("hlsfield.utils.subprocess.run", self.subprocess_run)
+        monkeypatch.setattr("hlsfield.utils.run", self.ffmpeg_run)
+        monkeypatch.setattr("hlsfield.utils.ensure_binary_available", self.ensure_binary)
 
     def test_tempdir_context_manager(self):
         """Тестируем контекстный менеджер для временных директорий"""
@@ -55,148 +240,181 @@ class TestUtils(TestCase):
         # Проверяем, что директория удаляется после контекста
         self.assertFalse(temp_path.exists())
 
-    @patch('hlsfield.utils.ensure_binary_available')
-    @patch('hlsfield.utils.subprocess.run')
-    def test_run_basic_command(self, mock_run, mock_ensure):
+    def test_tempdir_removes_nested_tree(self):
+        """Вложенные директории, сегменты и симлинки удаляются целиком"""
+        outside = self.test_dir / "outside.txt"
+        outside.write_text("keep")
+
+        with tempdir() as temp_path:
+            for variant in ("v360", "v720"):
+                variant_dir = temp_path / "hls" / variant
+                variant_dir.mkdir(parents=True)
+                for i in range(3):
+                    (variant_dir / f"seg_{i:04d}.ts").write_bytes(b"\x47")
+            (temp_path / "link").symlink_to(self.test_dir)
+
+        self.assertFalse(temp_path.exists())
+        # Симлинк удален, а не пройден
+        self.assertTrue(outside.exists())
+
+    def test_run_basic_command(self):
         """Тестируем выполнение базовых команд"""
-        mock_ensure.return_value = "echo"
-
-        from subprocess import CompletedProcess
-        mock_run.return_value = CompletedProcess(
-            args=["echo", "hello"],
-            returncode=0,
-            stdout="hello",
-            stderr=""
-        )
+        self.subprocess_run.return_value = _make_ok("hello")
 
         result = run(["echo", "hello"], timeout_sec=5)
         self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, "hello")
 
-    @patch('hlsfield.utils.ensure_binary_available')
-    @patch('hlsfield.utils.subprocess.run')
-    def test_run_with_timeout(self, mock_run, mock_ensure):
-        """Тестируем таймауты при выполнении команд"""
-        mock_ensure.return_value = "echo"  # Мокаем проверку бинарника
+    def test_run_allows_posix_spawn(self):
+        """FFmpeg запускается без close_fds - CPython может выбрать posix_spawn"""
+        self.ensure_binary.side_effect = lambda name, path: "/usr/bin/ffmpeg"
+
+        run(["ffmpeg", "-version"], timeout_sec=5)
+
+        args, kwargs = self.subprocess_run.call_args
+        self.assertEqual(args[0][0], "/usr/bin/ffmpeg")
+        self.assertFalse(kwargs["close_fds"])
+
+    def test_run_adds_ffmpeg_timelimit(self):
+        """FFmpeg получает -timelimit (CPU-секунды на все ядра), ffprobe - нет"""
+        self.monkeypatch.setattr("hlsfield.utils.os.cpu_count", lambda: 4)
+        run(["ffmpeg", "-i", "in.mp4", "out.jpg"], timeout_sec=60)
+        self.assertEqual(self.subprocess_run.call_args.args[0][:3], ["ffmpeg", "-timelimit", "240"])
+        self.assertEqual(self.subprocess_run.call_args.kwargs["timeout"], 60)
+
+        run(["ffprobe", "-i", "in.mp4"], timeout_sec=60)
+        self.assertNotIn("-timelimit", self.subprocess_run.call_args.args[0])
+
+    def test_run_ffmpeg_slots(self):
+        """FFmpeg занимает слот семафора, ffprobe - нет; -threads run() не добавляет"""
+        slots = MagicMock()
+        self.monkeypatch.setattr("hlsfield.utils._ffmpeg_slots", slots)
+
+        run(["ffmpeg", "-i", "in.mp4", "out.jpg"])
+        self.assertNotIn("-threads", self.subprocess_run.call_args.args[0])
+        self.assertEqual(slots.__enter__.call_count, 1)
+
+        run(["ffprobe", "-i", "in.mp4"])
+        self.assertEqual(slots.__enter__.call_count, 1)
 
-        import subprocess
-        mock_run.side_effect = subprocess.TimeoutExpired("test_cmd", 1)
+    def test_run_returns_run_result(self):
+        """run() возвращает RunResult: доступ по атрибутам и распаковка"""
+        self.subprocess_run.return_value = SimpleNamespace(returncode=0, stdout="out", stderr="err")
+
+        result = run(["ffprobe", "-version"])
+
+        self.assertIsInstance(result, RunResult)
+        self.assertEqual(result.stdout, "out")
+        returncode, stdout, stderr = result
+        self.assertEqual((returncode, stdout, stderr), (0, "out", "err"))
+
+    def test_run_with_timeout(self):
+        """Тестируем таймауты при выполнении команд"""
+        self.subprocess_run.side_effect = TimeoutExpired("test_cmd", 1)
 
         with self.assertRaises(TimeoutError):
             run(["echo", "test"], timeout_sec=1)
 
-    @patch('hlsfield.utils.subprocess.run')
-    def test_run_command_not_found(self, mock_run):
+    def test_run_command_not_found(self):
         """Тестируем обработку отсутствующей команды"""
-        mock_run.side_effect = FileNotFoundError("Command not found")
+        self.subprocess_run.side_effect = FileNotFoundError("Command not found")
 
-        with self.assertRaises(FFmpegNotFoundError):
+        with self.assertRaises(FFmpegNotFoundError) as ctx:
             run(["nonexistent_command"], timeout_sec=5)
+        # Старый код ловит FileNotFoundError - он по-прежнему срабатывает
+        self.assertIsInstance(ctx.exception, FileNotFoundError)
 
-    def test_pick_video_audio_streams(self):
-        """Тестируем выбор видео и аудио потоков"""
-        # Тестовые данные streams
-        test_info = {
-            "streams": [
-                {"codec_type": "video", "width": 1920, "height": 1080},
-                {"codec_type": "audio", "sample_rate": 44100},
-                {"codec_type": "video", "width": 1280, "height": 720},
-                {"codec_type": "audio", "sample_rate": 48000},
-            ]
-        }
-
-        video_stream, audio_stream = pick_video_audio_streams(test_info)
-
-        self.assertIsNotNone(video_stream)
-        self.assertIsNotNone(audio_stream)
-        self.assertEqual(video_stream["width"], 1920)
-        self.assertEqual(audio_stream["sample_rate"], 44100)
-
-    def test_pick_streams_no_audio(self):
-        """Тестируем выбор потоков когда нет аудио"""
-        test_info = {
-            "streams": [
-                {"codec_type": "video", "width": 1920, "height": 1080},
-            ]
-        }
-
-        video_stream, audio_stream = pick_video_audio_streams(test_info)
-
-        self.assertIsNotNone(video_stream)
-        self.assertIsNone(audio_stream)
-
-    def test_pick_streams_no_video(self):
-        """Тестируем выбор потоков когда нет видео"""
-        test_info = {
-            "streams": [
-                {"codec_type": "audio", "sample_rate": 44100},
-            ]
-        }
-
-        video_stream, audio_stream = pick_video_audio_streams(test_info)
-
-        self.assertIsNone(video_stream)
-        self.assertIsNotNone(audio_stream)
-
-    def test_pick_streams_empty(self):
-        """Тестируем выбор потоков из пустого списка"""
-        test_info = {"streams": []}
-
-        video_stream, audio_stream = pick_video_audio_streams(test_info)
-
-        self.assertIsNone(video_stream)
-        self.assertIsNone(audio_stream)
-
-    @patch('hlsfield.utils.run')
-    def test_get_video_info_quick_success(self, mock_run):
-        """Тестируем быстрый анализ видео"""
-        from subprocess import CompletedProcess
-        mock_run.return_value = CompletedProcess(
-            args=["ffprobe"],
-            returncode=0,
-            stdout='{"format": {"duration": "120.5", "size": "1024000", "bit_rate": "2000000"}}',
-            stderr=""
-        )
+    def test_get_video_info_quick_reads_mp4_header(self):
+        """Длительность MP4 читается из moov/mvhd без запуска ffprobe"""
+        def box(box_type, payload):
+            return struct.pack(">I4s", 8 + len(payload), box_type) + payload
 
-        info = get_video_info_quick(self.test_video)
+        # mvhd v0: version/flags, creation, modification, timescale, duration
+        mvhd = box(b"mvhd", struct.pack(">IIIII", 0, 0, 0, 1000, 120500) + b"\x00" * 80)
+        moov = box(b"moov", mvhd + box(b"trak", b"") + box(b"trak", b""))
+        mp4 = self.test_dir / "header.mp4"
+        mp4.write_bytes(box(b"ftyp", b"isom\x00\x00\x02\x00") + box(b"mdat", b"\x00" * 1000) + moov)
 
-        self.assertEqual(info["duration"], 120.5)
-        self.assertEqual(info["size"], 1024000)
-        self.assertEqual(info["bitrate"], 2000000)
+        info = get_video_info_quick(mp4)
 
-    @patch('hlsfield.utils.run')
-    def test_get_video_info_quick_failure(self, mock_run):
-        """Тестируем быстрый анализ при ошибке"""
-        mock_run.side_effect = Exception("FFprobe error")
+        self.ffmpeg_run.assert_not_called()
+        self.assertEqual(info["duration"], 120.5)
+        self.assertEqual(info["size"], mp4.stat().st_size)
+        self.assertEqual(info["bitrate"], int(mp4.stat().st_size * 8 / 120.5))
+        self.assertEqual(info["nb_streams"], 2)
 
-        info = get_video_info_quick(self.test_video)
+    def test_ffprobe_streams_batch(self):
+        """Тестируем пакетный анализ: порядок результатов и один запуск на файл"""
+        def probe(cmd, *args, **kwargs):
+            codec = "hevc" if cmd[-1].endswith("second.mp4") else "h264"
+            stdout = '{"streams": [{"codec_type": "video", "codec_name": "%s"}]}' % codec
+            return RunResult(0, stdout, "")
 
-        # Должен вернуть значения по умолчанию
-        self.assertEqual(info["duration"], 0)
-        self.assertEqual(info["size"], 0)
-        self.assertEqual(info["bitrate"], 0)
-        self.assertEqual(info["format_name"], "unknown")
+        self.ffmpeg_run.side_effect = probe
+        second = self.test_dir / "second.mp4"
+        second.write_bytes(b"\x00" * 32)
 
-    def test_validate_video_file_nonexistent(self):
-        """Тестируем валидацию несуществующего файла"""
-        result = validate_video_file("/nonexistent/path/video.mp4")
+        results = ffprobe_streams_batch([self.test_video, second, self.test_video])
 
+        self.assertEqual(
+            [r["streams"][0]["codec_name"] for r in results], ["h264", "hevc", "h264"]
+        )
+        self.assertEqual(self.ffmpeg_run.call_count, 2)
+
+    def test_validate_video_file_extension_case_insensitive(self):
+        """Расширение проверяется без учета регистра, неизвестное - ошибка"""
+        upper = self.test_dir / "CLIP.MP4"
+        upper.write_bytes(b"\x00" * 2000)
+        unknown = self.test_dir / "clip.xyz"
+        unknown.write_bytes(b"\x00" * 2000)
+
+        self.assertNotIn("Unsupported file extension: .mp4", validate_video_file(upper)["issues"])
+        self.assertIn("Unsupported file extension: .xyz", validate_video_file(unknown)["issues"])
+
+    def test_validate_video_file_sniffs_container(self):
+        """Контейнер определяется по заголовку; незнакомый - предупреждение и FFprobe"""
+        result = validate_video_file(self.test_video)
+        self.assertEqual(result["info"]["container"], "mp4")
+        self.assertEqual(self.ffmpeg_run.call_count, 1)
+
+        self.ffmpeg_run.reset_mock()
+        self.ffmpeg_run.return_value = RunResult(0, '{"streams": [], "format": {}}', "")
+        junk = self.test_dir / "junk.mp4"
+        junk.write_bytes(b"not a video" * 200)
+
+        result = validate_video_file(junk)
+
+        self.assertIsNone(result["info"]["container"])
+        self.assertIn("Unrecognized video container signature", result["warnings"])
+        self.assertEqual(self.ffmpeg_run.call_count, 1)
+        # Решение за FFprobe: потоков нет - файл отклоняется
+        self.assertIn("No video stream found", result["issues"])
         self.assertFalse(result["valid"])
-        self.assertIn("File does not exist", result["issues"])
 
-    def test_validate_video_file_empty(self):
-        """Тестируем валидацию пустого файла"""
-        empty_file = self.test_dir / "empty.mp4"
-        empty_file.touch()
+    def test_analyze_video_complexity_uses_prefetched_streams(self):
+        """Переданный результат ffprobe используется без повторного запуска"""
+        analysis = analyze_video_complexity(self.test_video, streams={"format": {"duration": "42.5"}})
 
-        result = validate_video_file(empty_file)
+        self.assertEqual(analysis["duration"], 42.5)
+        self.ffmpeg_run.assert_not_called()
+
+    def test_validate_video_file_with_mock_probe(self):
+        """Тестируем валидацию с mock FFprobe"""
+        self.monkeypatch.setattr("hlsfield.utils.ffprobe_streams", lambda path: _PROBE_1080P)
+
+        result = validate_video_file(self.big_mp4)
+
+        self.assertTrue(result["valid"])
+        self.assertEqual(len(result["issues"]), 0)
+
+    def test_validate_video_file_no_video_stream(self):
+        """Тестируем валидацию файла без видео потока"""
+        self.monkeypatch.setattr("hlsfield.utils.ffprobe_streams", lambda path: _PROBE_AUDIO_ONLY)
+
+        result = validate_video_file(self.big_mp4)
 
         self.assertFalse(result["valid"])
-        # Проверяем что есть хотя бы одна из ошибок
-        issues_text = " ".join(result["issues"])
-        self.assertTrue(
-            "File too small" in issues_text or
-            "Cannot analyze video" in issues_text
-        )
+        self.assertIn("No video stream found", result["issues"])
 
     def test_pull_to_local_with_direct_access(self):
         """Тестируем загрузку файла с прямым доступом"""
@@ -209,71 +427,149 @@ class TestUtils(TestCase):
         self.assertEqual(local_path, self.test_video)
 
     def test_pull_to_local_with_storage_api(self):
-        """Тестируем загрузку через storage API - ИСПРАВЛЕННАЯ ВЕРСИЯ"""
-        mock_storage = Mock()
-        # Эмулируем, что прямой путь не доступен
-        mock_storage.path.side_effect = NotImplementedError
-
-        # ИСПРАВЛЯЕМ: создаем правильный мок для file-like объекта
+        """Тестируем загрузку через storage API"""
         test_content = b"test video content"
+        storage = FakeStorage({"test.mp4": test_content})
 
-        # Создаем мок файла, который поддерживает чтение по чанкам
-        mock_file_content = Mock()
-        mock_file_content.read = Mock(side_effect=[test_content, b''])  # Первый вызов возвращает данные, второй - EOF
-
-        mock_storage.open.return_value.__enter__ = Mock(return_value=mock_file_content)
-        mock_storage.open.return_value.__exit__ = Mock(return_value=None)
-
-        local_path = pull_to_local(mock_storage, "test.mp4", self.test_dir)
+        local_path = pull_to_local(storage, "test.mp4", self.test_dir)
 
         self.assertTrue(local_path.exists())
         self.assertEqual(local_path.read_bytes(), test_content)
 
-    def test_pull_to_local_storage_error(self):
-        """Тестируем ошибку при загрузке из storage"""
+    def test_pull_to_local_real_file_object(self):
+        """Тестируем копирование настоящего файла из storage (путь через fileno)"""
+        source = self.test_dir / "source.mp4"
+        source.write_bytes(b"\x00\x01" * 4096)
+        dst_dir = self.test_dir / "dst"
+        dst_dir.mkdir()
+
         mock_storage = Mock()
         mock_storage.path.side_effect = NotImplementedError
-        mock_storage.open.side_effect = Exception("Storage error")
+        mock_storage.open.side_effect = lambda name, mode: open(source, mode)
 
+        local_path = pull_to_local(mock_storage, "source.mp4", dst_dir)
+
+        self.assertEqual(local_path.read_bytes(), source.read_bytes())
+
+    def test_pull_to_local_storage_error(self):
+        """Тестируем ошибку при загрузке из storage"""
         with self.assertRaises(StorageError):
-            pull_to_local(mock_storage, "nonexistent.mp4", self.test_dir)
+            pull_to_local(FakeStorage(), "nonexistent.mp4", self.test_dir)
 
     def test_save_tree_to_storage(self):
         """Тестируем сохранение дерева файлов в storage"""
-        # Создаем тестовую структуру файлов
-        test_tree = self.test_dir / "test_tree"
+        storage = FakeStorage()
+
+        saved_paths = save_tree_to_storage(self.file_tree, storage, "base/path")
+
+        self.assertEqual(len(saved_paths), 2)
+        self.assertEqual(storage.files, {
+            "base/path/file1.txt": b"content1",
+            "base/path/subdir/file2.txt": b"content2",
+        })
+
+    def test_save_tree_to_storage_keeps_walk_order(self):
+        """Параллельная загрузка возвращает ключи в порядке обхода дерева"""
+        test_tree = self.test_dir / "hls"
         test_tree.mkdir()
+        for i in range(8):
+            (test_tree / f"seg_{i:04d}.ts").write_bytes(b"\x47")
 
-        (test_tree / "file1.txt").write_text("content1")
-        (test_tree / "subdir").mkdir()
-        (test_tree / "subdir" / "file2.txt").write_text("content2")
+        saved_paths = save_tree_to_storage(test_tree, FakeStorage(), "videos/1/")
 
-        mock_storage = Mock()
-        mock_storage.save.return_value = "saved_path"
+        expected = [f"videos/1/{name}" for _, _, files in os.walk(test_tree) for name in files]
+        self.assertEqual(saved_paths, expected)
 
-        saved_paths = save_tree_to_storage(test_tree, mock_storage, "base/path")
+    def test_save_tree_to_storage_default_workers_from_settings(self):
+        """Без max_workers глубина пула берется из HLSFIELD_STORAGE_IO_WORKERS"""
+        test_tree = self.test_dir / "workers_tree"
+        test_tree.mkdir()
+        for i in range(4):
+            (test_tree / f"seg_{i}.ts").write_bytes(b"\x47")
 
-        self.assertEqual(len(saved_paths), 2)
-        self.assertEqual(mock_storage.save.call_count, 2)
+        pool = Mock(wraps=ThreadPoolExecutor)
+        self.monkeypatch.setattr("hlsfield.defaults.STORAGE_IO_WORKERS", 2)
+        self.monkeypatch.setattr("hlsfield.utils.ThreadPoolExecutor", pool)
 
-    @patch('hlsfield.utils.run')
-    def test_extract_preview_success(self, mock_run):
-        """Тестируем извлечение превью (успешный случай)"""
-        from subprocess import CompletedProcess
-        mock_run.return_value = CompletedProcess(
-            args=["ffmpeg"],
-            returncode=0,
-            stdout="",
-            stderr=""
-        )
+        save_tree_to_storage(test_tree, FakeStorage(), "base")
+
+        self.assertEqual(pool.call_args.kwargs["max_workers"], 2)
+
+    def test_save_tree_to_storage_retries_transient_errors(self):
+        """Сетевые сбои повторяются, остальные ошибки - нет"""
+        test_tree = self.test_dir / "retry_tree"
+        test_tree.mkdir()
+        (test_tree / "index.m3u8").write_text("#EXTM3U\n")
+
+        mock_storage = Mock()
+        mock_storage.save.side_effect = [ConnectionError("reset"), ConnectionError("reset"), "saved"]
+        self.assertEqual(save_tree_to_storage(test_tree, mock_storage, "base"), ["saved"])
+        self.assertEqual(mock_storage.save.call_count, 3)
 
-        # Создаем реальный выходной файл с содержимым
+        mock_storage.save.reset_mock(side_effect=True)
+        mock_storage.save.side_effect = PermissionError("denied")
+        with self.assertRaises(StorageError):
+            save_tree_to_storage(test_tree, mock_storage, "base")
+        self.assertEqual(mock_storage.save.call_count, 1)
+
+    def test_extract_preview_success(self):
+        """Тестируем извлечение превью (успешный случай)"""
         output_image = self.test_dir / "preview.jpg"
-        # Моделируем создание файла FFmpeg'ом
-        output_image.write_bytes(b'\x00' * 1000)  # Файл > 100 байт
+
+        def fake_ffmpeg(cmd, *args, **kwargs):
+            # Кадр пишет "FFmpeg": файл > 100 байт
+            output_image.write_bytes(b'\x00' * 1000)
+            return RunResult(0, "", "")
+
+        self.ffmpeg_run.side_effect = fake_ffmpeg
 
         result = extract_preview(self.test_video, output_image, at_sec=1.0)
         self.assertEqual(result, output_image)
+        self.ffmpeg_run.assert_called_once()
+
+    def test_extract_preview_failure(self):
+        """FFmpeg не создал кадр ни в одной попытке - TranscodingError"""
+        output_image = self.test_dir / "preview.jpg"
+
+        with self.assertRaises(TranscodingError):
+            extract_preview(self.test_video, output_image, at_sec=1.0)
+        self.assertEqual(self.ffmpeg_run.call_count, 3)
+
+    def test_extract_preview_empty_output_retries_earlier(self):
+        """Пустой вывод по stderr FFmpeg - сразу следующая попытка с более ранней меткой"""
+        output_image = self.test_dir / "preview.jpg"
+
+        def fake_ffmpeg(cmd, *args, **kwargs):
+            if cmd[cmd.index("-ss") + 1] == "300.0":
+                return RunResult(0, "", "Output file is empty, nothing was encoded")
+            output_image.write_bytes(b'\x00' * 1000)
+            return RunResult(0, "", "frame=    1 fps=0.0")
+
+        self.ffmpeg_run.side_effect = fake_ffmpeg
+
+        self.assertEqual(extract_preview(self.test_video, output_image, at_sec=300.0), output_image)
+        self.assertEqual(self.ffmpeg_run.call_count, 2)
+
+    def test_extract_previews_multi_single_call(self):
+        """Несколько превью - один вызов FFmpeg, метка за концом видео пропускается"""
+        out_dir = self.test_dir / "previews"
+
+        def fake_ffmpeg(cmd, *args, **kwargs):
+            # Кадр есть только для первых двух меток
+            for name in ("preview_00.jpg", "preview_01.jpg"):
+                (out_dir / name).write_bytes(b'\x00' * 1000)
+            return RunResult(0, "", "")
+
+        self.ffmpeg_run.side_effect = fake_ffmpeg
+
+        result = extract_previews_multi(self.test_video, out_dir, [1.0, 5.0, 9999.0], width=320)
+
+        self.assertEqual(result, [out_dir / "preview_00.jpg", out_dir / "preview_01.jpg"])
+        self.ffmpeg_run.assert_called_once()
+        cmd = self.ffmpeg_run.call_args.args[0]
+        self.assertEqual(cmd.count("-i"), 3)
+        self.assertEqual(cmd.count("scale=320:-1"), 3)
+        self.assertLess(cmd.index("-ss"), cmd.index("-i"))
 
 
 class TestErrorHandling(TestCase):
@@ -320,8 +616,11 @@ class TestUtilsHelpers(TestCase):
         self.assertIsInstance(result["info"], dict)
 
 
-# Интеграционные тесты (пропускаются если нет FFmpeg)
+# Интеграционные тесты (пропускаются если нет FFmpeg).
+# Настоящий FFmpeg не гоняем параллельно: под --dist=loadgroup группа
+# целиком попадает на один воркер
 @pytest.mark.integration
+@pytest.mark.xdist_group("ffmpeg")
 class TestIntegrationWithFFmpeg(TestCase):
 
     @pytest.mark.skipif(not shutil.which("ffmpeg"), reason="Требует реального FFmpeg")